@@ -1,3 +1,4 @@
+import os
 import pandas as pd
 import numpy as np
 from scipy.stats import norm
@@ -6,7 +7,8 @@ def prep_conjoint(df,
                   respondent_columns=['responseid', 'gender', 'age'], 
                   regex_list='pv|mix|imports|tradeoffs|distribution', 
                   filemarker='stack-choice', 
-                  calculate_ratings=True):
+                  calculate_ratings=True, 
+                  output_dir='data'):
 
     '''
     Change the conjoint data from wide to long format. 
@@ -18,6 +20,7 @@ def prep_conjoint(df,
     - respondent_columns: by default three basic columns as chosen, 
     otherwise provide a vector of strings, containing the desired 
     column names 
+    - output_dir: folder the stacked csv file is written to
 
     Returns a long data frame with each observation within the conjoint 
     experiment on its own row
@@ -134,14 +137,16 @@ def prep_conjoint(df,
         stack_both = stack_both.dropna(subset=['choice'])
 
         # save to file
-        stack_both.to_csv(f'data/{filemarker}_conjoint.csv', index=False)
-        print(f'Stacked choice and rating data saved to file data/{filemarker}_conjoint.csv')
+        output_file = os.path.join(output_dir, f'{filemarker}_conjoint.csv')
+        stack_both.to_csv(output_file, index=False)
+        print(f'Stacked choice and rating data saved to file {output_file}')
         return stack_both
 
     else: 
         stack_choice = stack_choice.dropna(subset=['choice'])
-        stack_choice.to_csv(f'data/{filemarker}_choices.csv', index=False)
-        print(f'Stacked choice data saved to file data/{filemarker}_choices.csv')
+        output_file = os.path.join(output_dir, f'{filemarker}_choices.csv')
+        stack_choice.to_csv(output_file, index=False)
+        print(f'Stacked choice data saved to file {output_file}')
         return stack_choice
     
 
@@ -48,4 +48,41 @@ def rename_columns(df, original_str, replacement_str):
     - DataFrame with updated column names
     """
     df.rename(columns=lambda x: x.replace(original_str, replacement_str), inplace=True)
-    return df
\ No newline at end of file
+    return df
+
+
+def cronbach_alpha(df):
+    """
+    Calculate Cronbach's alpha for a set of items.
+
+    Parameters:
+    - df: pandas DataFrame where each column is a measurement/item
+
+    Returns:
+    - Cronbach's alpha of the items
+    """
+    item_scores = df.values
+    item_variances = item_scores.var(axis=0, ddof=1)
+    total_score_var = item_scores.sum(axis=1).var(ddof=1)
+    n_items = df.shape[1]
+
+    return (n_items / (n_items - 1)) * (1 - item_variances.sum() / total_score_var)
+
+
+def justice_reliability(df):
+    """
+    Calculate Cronbach's alpha of the three items of each justice principle.
+
+    Parameters:
+    - df: pandas DataFrame with the numeric justice columns, e.g. lpa_input.csv
+
+    Returns:
+    - Dictionary with the alpha of each principle
+    """
+    justice_columns = {
+        'utilitarian': ['justice_general_1', 'justice_tax_1', 'justice_subsidy_1'],
+        'egalitarian': ['justice_general_2', 'justice_tax_2', 'justice_subsidy_2'],
+        'sufficientarian': ['justice_general_3', 'justice_tax_3', 'justice_subsidy_3'],
+        'limitarian': ['justice_general_4', 'justice_tax_4', 'justice_subsidy_4']
+    }
+    return {principle: cronbach_alpha(df[columns].dropna()) for principle, columns in justice_columns.items()}
@@ -0,0 +1,179 @@
+import pandas as pd
+import numpy as np
+from scipy.stats import chi2, norm
+
+
+def encode_attributes(df, attributes):
+    '''
+    Integer-code the attribute levels of a stacked conjoint dataframe.
+
+    Parameters:
+    - df: long dataframe as returned by prep_conjoint
+    - attributes: list of attribute column names, coded in sorted order,
+    or a dictionary of attributes and their levels, e.g.
+    experiment_levels['heat'], coded in the given order
+
+    Returns an (observations x attributes) integer array with -1 for
+    missing or unknown levels, and a list with the levels of each attribute
+    '''
+    codes = np.empty((len(df), len(attributes)), dtype=np.int64)
+    levels = []
+    for j, attribute in enumerate(attributes):
+        values, uniques = pd.factorize(df[attribute], sort=True)
+        if isinstance(attributes, dict):
+            # compare as strings, so years read as 2050 or 2050.0 match '2050'
+            uniques = pd.Index(uniques).astype(str).str.replace(r'\.0$', '', regex=True)
+            lookup = pd.Index(attributes[attribute]).get_indexer(uniques)
+            codes[:, j] = np.where(values >= 0, lookup[values], -1)
+            levels.append(pd.Index(attributes[attribute]))
+        else:
+            codes[:, j] = values
+            levels.append(uniques)
+    return codes, levels
+
+
+def _chi2_independence(table):
+    # pearson chi-square on a contingency table, ignoring empty rows and columns
+    table = np.asarray(table, dtype=float)
+    table = table[table.sum(axis=1) > 0][:, table.sum(axis=0) > 0]
+    dof = (table.shape[0] - 1) * (table.shape[1] - 1)
+    if dof <= 0:
+        return np.nan, 0, np.nan
+    expected = np.outer(table.sum(axis=1), table.sum(axis=0)) / table.sum()
+    statistic = ((table - expected) ** 2 / expected).sum()
+    return statistic, dof, chi2.sf(statistic, dof)
+
+
+def _chi2_homogeneity(shown, chosen):
+    # sum over levels of the chi-square tests that the choice rate of a level is the same in all groups
+    statistic, dof = 0.0, 0
+    for n_level, y_level in zip(shown, chosen):
+        level_stat, level_dof, _ = _chi2_independence(np.stack([y_level, n_level - y_level]))
+        if level_dof > 0:
+            statistic += level_stat
+            dof += level_dof
+    return statistic, dof, chi2.sf(statistic, dof) if dof > 0 else np.nan
+
+
+def design_diagnostics(df,
+                       attributes,
+                       outcome='Y',
+                       id_column='id',
+                       position_column='pack_num_cat',
+                       task_column='task_num',
+                       original_task=1,
+                       repeat_task=8):
+    '''
+    Check the randomisation of a conjoint experiment in one pass over the stack.
+
+    All level, position and task tables are margins of one bincount over
+    the integer-coded attribute levels crossed with position and task, so
+    the checks cost about as much as a single groupby. Carryover is checked
+    the same way, crossing each level with the level the same position
+    showed in the respondent's previous task.
+
+    Parameters:
+    - df: long dataframe as returned by prep_conjoint
+    - attributes: list of attribute columns, or dictionary of attributes
+    and levels, e.g. experiment_levels['heat'], see encode_attributes
+    - outcome: binary choice column
+    - position_column: column with the Left/Right position of the package
+    - task_column: column with the task number
+    - original_task, repeat_task: task and its repeated duplicate, the
+    repeat is left out of the balance and order checks
+
+    Returns three outputs:
+    - levels: dataframe with the count, share, share on the left and
+    choice rate of each attribute level
+    - tests: dataframe with one chi-square test per attribute and check
+    (level balance, balance across positions and tasks, position and
+    task effects on the choice rate of the levels, and carryover of the
+    previous task's level on the choice rate)
+    - summary: dictionary with the overall left-choice rate and the
+    consistency of the repeated task
+    '''
+    codes, levels = encode_attributes(df, attributes)
+    position, positions = pd.factorize(df[position_column], sort=True)
+    task, tasks = pd.factorize(df[task_column], sort=True)
+    y = df[outcome].to_numpy(dtype=float)
+    n_pos, n_task = len(positions), len(tasks)
+
+    # one bincount over attribute level x position x task for all attributes at once
+    offsets = np.concatenate([[0], np.cumsum([len(level) for level in levels])])
+    main = (task != tasks.get_loc(repeat_task)) if repeat_task in tasks else np.ones(len(df), dtype=bool)
+    valid = (codes >= 0) & main[:, None] & (position >= 0)[:, None]
+    keys = ((codes + offsets[:-1]) * n_pos + position[:, None]) * n_task + task[:, None]
+    size = offsets[-1] * n_pos * n_task
+    shown = np.bincount(keys[valid], minlength=size).reshape(offsets[-1], n_pos, n_task)
+    chosen = np.bincount(keys[valid], weights=np.broadcast_to(y[:, None], keys.shape)[valid],
+                         minlength=size).reshape(offsets[-1], n_pos, n_task)
+
+    # level shown in the same position of the previous task, -1 for the first task
+    ids = df[id_column].to_numpy()
+    task_values = df[task_column].to_numpy()
+    rows = pd.DataFrame({'id': ids, 'task': task_values, 'position': position})
+    previous = rows.assign(task=task_values + 1, row=np.arange(len(df)))[main].drop_duplicates(['id', 'task', 'position'])
+    previous_row = rows.merge(previous, on=['id', 'task', 'position'], how='left')['row'].to_numpy()
+    has_previous = ~np.isnan(previous_row)
+    previous_codes = np.full(codes.shape, -1)
+    previous_codes[has_previous] = codes[previous_row[has_previous].astype(np.int64)]
+
+    # one bincount over attribute level x previous level of the same attribute
+    max_levels = max(len(level) for level in levels)
+    carry_valid = valid & (previous_codes >= 0)
+    carry_keys = (codes + offsets[:-1]) * max_levels + previous_codes
+    carry_size = offsets[-1] * max_levels
+    carry_shown = np.bincount(carry_keys[carry_valid], minlength=carry_size).reshape(offsets[-1], max_levels)
+    carry_chosen = np.bincount(carry_keys[carry_valid], weights=np.broadcast_to(y[:, None], keys.shape)[carry_valid],
+                               minlength=carry_size).reshape(offsets[-1], max_levels)
+
+    level_tables, test_rows = [], []
+    for j, attribute in enumerate(attributes):
+        shown_a, chosen_a = shown[offsets[j]:offsets[j + 1]], chosen[offsets[j]:offsets[j + 1]]
+        counts = shown_a.sum(axis=(1, 2))
+        level_tables.append(pd.DataFrame({
+            'attribute': attribute,
+            'level': levels[j],
+            'count': counts,
+            'share': counts / counts.sum(),
+            'expected_share': 1 / len(counts),
+            'share_left': shown_a[:, 0, :].sum(axis=1) / np.maximum(counts, 1),
+            'choice_rate': chosen_a.sum(axis=(1, 2)) / np.maximum(counts, 1)
+        }))
+
+        balance = ((counts - counts.mean()) ** 2 / counts.mean()).sum()
+        checks = {
+            'level balance': (balance, len(counts) - 1, chi2.sf(balance, len(counts) - 1)),
+            'position balance': _chi2_independence(shown_a.sum(axis=2)),
+            'task balance': _chi2_independence(shown_a.sum(axis=1)),
+            'position effect': _chi2_homogeneity(shown_a.sum(axis=2), chosen_a.sum(axis=2)),
+            'task effect': _chi2_homogeneity(shown_a.sum(axis=1), chosen_a.sum(axis=1)),
+            'carryover effect': _chi2_homogeneity(carry_shown[offsets[j]:offsets[j + 1]],
+                                                  carry_chosen[offsets[j]:offsets[j + 1]])
+        }
+        for check, (statistic, dof, p) in checks.items():
+            test_rows.append({'attribute': attribute, 'check': check, 'statistic': statistic, 'df': dof, 'p': p})
+
+    # overall preference for the left package
+    left = main & (position == 0)
+    n_left = left.sum()
+    left_rate = y[left].mean()
+    left_z = (left_rate - 0.5) / np.sqrt(0.25 / n_left)
+
+    # repeated task: do respondents choose the same profile again
+    radix = np.concatenate([np.cumprod(np.diff(offsets)[::-1])[::-1][1:], [1]])
+    profile = codes @ radix
+    original = pd.DataFrame({'id': ids, 'profile': profile, 'y': y})[task_values == original_task]
+    repeat = pd.DataFrame({'id': ids, 'profile': profile, 'y': y})[task_values == repeat_task]
+    chosen_pairs = original[original['y'] == 1].merge(repeat[repeat['y'] == 1], on='id', suffixes=('_original', '_repeat'))
+    agreement = (chosen_pairs['profile_original'] == chosen_pairs['profile_repeat']).mean() if len(chosen_pairs) else np.nan
+
+    summary = {
+        'respondents': df[id_column].nunique(),
+        'left_choice_rate': left_rate,
+        'left_choice_p': 2 * norm.sf(np.abs(left_z)),
+        'repeat_agreement': agreement,
+        'repeat_respondents': chosen_pairs['id'].nunique()
+    }
+
+    return pd.concat(level_tables, ignore_index=True), pd.DataFrame(test_rows), summary
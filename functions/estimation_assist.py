@@ -0,0 +1,242 @@
+import pandas as pd
+import numpy as np
+from scipy.stats import norm
+from functions.design_assist import encode_attributes
+
+
+def filter_respondents(df,
+                       filter_speeders=True,
+                       filter_laggards=True,
+                       filter_inattentives=True):
+    '''
+    Drop speeders, laggards and inattentive respondents, as filter_respondents in r-assist.R.
+
+    Parameters:
+    - df: dataframe with boolean 'speeder', 'laggard' and 'inattentive' columns
+    - filter_speeders, filter_laggards, filter_inattentives: which flags to filter on
+
+    Returns the filtered dataframe
+    '''
+    flags = [flag for flag, use in [('speeder', filter_speeders),
+                                    ('laggard', filter_laggards),
+                                    ('inattentive', filter_inattentives)] if use]
+    if not flags:
+        return df
+    mask = df[flags].astype(str).apply(lambda col: col.str.lower() == 'true').any(axis=1)
+    print(f"Number of unique respondents (ids) filtered out: {df.loc[mask, 'id'].nunique()}")
+    return df[~mask]
+
+
+def design_matrix(df, levels):
+    '''
+    Dummy-code the attributes of a stacked conjoint dataframe.
+
+    Parameters:
+    - df: long dataframe as returned by prep_conjoint
+    - levels: dictionary of attributes and their levels with the baseline
+    first, e.g. experiment_levels['heat']
+
+    Returns the design matrix with an intercept and one column per
+    non-baseline level, the column names as 'attribute:level', and a
+    boolean mask of the rows with all attribute levels known
+    '''
+    codes, _ = encode_attributes(df, levels)
+    offsets = np.concatenate([[1], 1 + np.cumsum([len(level) - 1 for level in levels.values()])])
+    X = np.zeros((len(df), offsets[-1]))
+    X[:, 0] = 1
+    rows = np.arange(len(df))
+    for j in range(codes.shape[1]):
+        dummy = codes[:, j] > 0
+        X[rows[dummy], offsets[j] + codes[dummy, j] - 1] = 1
+    names = ['(Intercept)'] + [f'{attribute}:{level}' for attribute, attribute_levels in levels.items()
+                               for level in attribute_levels[1:]]
+    return X, names, (codes >= 0).all(axis=1)
+
+
+def cluster_crossproducts(X, y, clusters):
+    '''
+    Sum the cross-products of the design and outcome within each cluster.
+
+    These are sufficient statistics for OLS: any fit on a subset or
+    reweighting of the clusters only needs weighted sums of them.
+
+    Parameters:
+    - X: design matrix
+    - y: outcome vector
+    - clusters: cluster of each row, e.g. the respondent id
+
+    Returns a dictionary with per-cluster 'xtx' (clusters x p x p), 'xty'
+    (clusters x p), 'yty' and 'n', and the cluster labels in 'clusters'
+    '''
+    cluster_codes, labels = pd.factorize(np.asarray(clusters), sort=True)
+    order = np.argsort(cluster_codes, kind='stable')
+    starts = np.searchsorted(cluster_codes[order], np.arange(len(labels)))
+    X, y = X[order], np.asarray(y, dtype=float)[order]
+
+    # outer products in blocks of whole clusters of about block_rows rows, so memory does not grow with rows x p x p
+    p = X.shape[1]
+    block_rows = max(1, (1 << 22) // (p * p))
+    xtx = np.empty((len(labels), p, p))
+    first = 0
+    while first < len(labels):
+        last = max(first + 1, np.searchsorted(starts, starts[first] + block_rows))
+        stop = starts[last] if last < len(labels) else len(X)
+        rows = X[starts[first]:stop]
+        xtx[first:last] = np.add.reduceat(rows[:, :, None] * rows[:, None, :], starts[first:last] - starts[first])
+        first = last
+    return {
+        'xtx': xtx,
+        'xty': np.add.reduceat(X * y[:, None], starts),
+        'yty': np.add.reduceat(y ** 2, starts),
+        'n': np.bincount(cluster_codes, minlength=len(labels)),
+        'clusters': labels
+    }
+
+
+def fit_crossproducts(stats, weights=None, vcov=True):
+    '''
+    Fit OLS with cluster-robust (CR1) standard errors from per-cluster cross-products.
+
+    Parameters:
+    - stats: dictionary as returned by cluster_crossproducts
+    - weights: cluster weights, either one vector (clusters) or a matrix
+    (fits x clusters) to fit many subsets or bootstrap resamples at once;
+    0/1 weights select clusters, by default all clusters are used
+    - vcov: whether to compute the clustered covariance matrices
+
+    Returns the coefficients (p, or fits x p) and, if vcov, their
+    covariance matrices (p x p, or fits x p x p)
+    '''
+    xtx, xty = stats['xtx'], stats['xty']
+    nr_clusters, p = xty.shape
+    weights = np.ones(nr_clusters) if weights is None else np.asarray(weights, dtype=float)
+    single = weights.ndim == 1
+    weights = np.atleast_2d(weights)
+
+    xtx_sum = (weights @ xtx.reshape(nr_clusters, p * p)).reshape(-1, p, p)
+    beta = np.linalg.solve(xtx_sum, (weights @ xty)[:, :, None])[:, :, 0]
+    if not vcov:
+        return beta[0] if single else beta
+
+    # cluster scores X_g'e_g = X_g'y_g - X_g'X_g beta
+    scores = xty[None, :, :] - np.einsum('gpq,rq->rgp', xtx, beta)
+    meat = np.einsum('rg,rgp,rgq->rpq', weights, scores, scores)
+    bread = np.linalg.inv(xtx_sum)
+    nr_used = (weights > 0).sum(axis=1)
+    nr_obs = weights @ stats['n']
+    correction = nr_used / np.maximum(nr_used - 1, 1) * (nr_obs - 1) / (nr_obs - p)
+    cov = correction[:, None, None] * bread @ meat @ bread
+    return (beta[0], cov[0]) if single else (beta, cov)
+
+
+def bootstrap_coefficients(stats, nr_draws=500, seed=None):
+    '''
+    Draw OLS coefficients from a respondent-clustered bootstrap.
+
+    Parameters:
+    - stats: dictionary as returned by cluster_crossproducts
+    - nr_draws: number of bootstrap resamples
+    - seed: seed of the random number generator
+
+    Returns a (draws x p) array of coefficients
+    '''
+    rng = np.random.default_rng(seed)
+    nr_clusters = len(stats['n'])
+    counts = rng.multinomial(nr_clusters, np.full(nr_clusters, 1 / nr_clusters), size=nr_draws)
+    return fit_crossproducts(stats, counts, vcov=False)
+
+
+def _estimate_table(estimate, se, outcome, statistic, features, levels):
+    z = estimate / se
+    return pd.DataFrame({
+        'outcome': outcome,
+        'statistic': statistic,
+        'feature': features,
+        'level': levels,
+        'estimate': estimate,
+        'std.error': se,
+        'z': z,
+        'p': 2 * (1 - norm.cdf(np.abs(z))),
+        'lower': estimate - 1.96 * se,
+        'upper': estimate + 1.96 * se
+    })
+
+
+def amce(df, levels, outcome='Y', id_column='id', by=None):
+    '''
+    Estimate AMCEs with respondent-clustered standard errors, as cj(..., estimate = "amce").
+
+    Parameters:
+    - df: long dataframe as returned by prep_conjoint
+    - levels: dictionary of attributes and their levels with the baseline first
+    - outcome: outcome column, e.g. 'Y' or 'rating'
+    - id_column: respondent id column to cluster on
+    - by: optional column to estimate the AMCEs separately per subgroup
+
+    Returns a dataframe in the layout of cregg, with baseline levels at zero
+    '''
+    if by is not None:
+        tables = [amce(group, levels, outcome, id_column).assign(BY=name)
+                  for name, group in df.groupby(by, observed=True)]
+        return pd.concat(tables, ignore_index=True)
+
+    X, names, valid = design_matrix(df, levels)
+    valid &= df[outcome].notna().to_numpy()
+    stats = cluster_crossproducts(X[valid], df[outcome].to_numpy()[valid], df[id_column].to_numpy()[valid])
+    beta, cov = fit_crossproducts(stats)
+
+    estimate, se, features, level_names = [], [], [], []
+    column = 1
+    for attribute, attribute_levels in levels.items():
+        for k, level in enumerate(attribute_levels):
+            features.append(attribute)
+            level_names.append(level)
+            if k == 0:
+                estimate.append(0.0)
+                se.append(np.nan)
+            else:
+                estimate.append(beta[column])
+                se.append(np.sqrt(cov[column, column]))
+                column += 1
+    return _estimate_table(np.array(estimate), np.array(se), outcome, 'amce', features, level_names)
+
+
+def marginal_means(df, levels, outcome='Y', id_column='id', by=None):
+    '''
+    Estimate marginal means with respondent-clustered standard errors, as cj(..., estimate = "mm").
+
+    Parameters:
+    - df: long dataframe as returned by prep_conjoint
+    - levels: dictionary of attributes and their levels
+    - outcome: outcome column, e.g. 'Y' or 'rating'
+    - id_column: respondent id column to cluster on
+    - by: optional column to estimate the MMs separately per subgroup
+
+    Returns a dataframe in the layout of cregg
+    '''
+    if by is not None:
+        tables = [marginal_means(group, levels, outcome, id_column).assign(BY=name)
+                  for name, group in df.groupby(by, observed=True)]
+        return pd.concat(tables, ignore_index=True)
+
+    codes, _ = encode_attributes(df, levels)
+    y = df[outcome].to_numpy(dtype=float)
+    cluster, labels = pd.factorize(df[id_column])
+    offsets = np.concatenate([[0], np.cumsum([len(level) for level in levels.values()])])
+    nr_levels = offsets[-1]
+
+    # all levels of all attributes in one bincount, and per cluster for the clustered variance
+    valid = (codes >= 0) & ~np.isnan(y)[:, None]
+    keys = (codes + offsets[:-1])[valid]
+    y_keys = np.broadcast_to(y[:, None], codes.shape)[valid]
+    n = np.bincount(keys, minlength=nr_levels)
+    mean = np.bincount(keys, weights=y_keys, minlength=nr_levels) / np.maximum(n, 1)
+    cluster_keys = np.broadcast_to(cluster[:, None], codes.shape)[valid] * nr_levels + keys
+    residual_sums = np.bincount(cluster_keys, weights=y_keys - mean[keys], minlength=len(labels) * nr_levels)
+    nr_clusters = len(labels)
+    variance = (residual_sums.reshape(nr_clusters, nr_levels) ** 2).sum(axis=0) / np.maximum(n, 1) ** 2
+    se = np.sqrt(variance * nr_clusters / (nr_clusters - 1))
+
+    features = [attribute for attribute, attribute_levels in levels.items() for _ in attribute_levels]
+    level_names = [level for attribute_levels in levels.values() for level in attribute_levels]
+    return _estimate_table(mean, se, outcome, 'mm', features, level_names)
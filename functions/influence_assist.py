@@ -0,0 +1,134 @@
+import pandas as pd
+import numpy as np
+from functions.design_assist import encode_attributes
+from functions.estimation_assist import design_matrix, cluster_crossproducts, fit_crossproducts
+
+
+def _unit_sums(df, id_column, clusters, by, *arrays):
+    # sums of per-cluster arrays within each left-out unit, the clusters themselves when by is None
+    if by is None:
+        return pd.Index(clusters), arrays
+    unit_of_cluster = df.drop_duplicates(id_column).set_index(id_column)[by].reindex(clusters)
+    codes, units = pd.factorize(unit_of_cluster, sort=True)
+    keep = codes >= 0
+    sums = []
+    for array in arrays:
+        total = np.zeros((len(units),) + array.shape[1:])
+        np.add.at(total, codes[keep], array[keep])
+        sums.append(total)
+    return units, sums
+
+
+def _feature_labels(levels, include_baseline):
+    features = [attribute for attribute, attribute_levels in levels.items()
+                for level in (attribute_levels if include_baseline else attribute_levels[1:])]
+    level_names = [level for attribute_levels in levels.values()
+                   for level in (attribute_levels if include_baseline else attribute_levels[1:])]
+    return features, level_names
+
+
+def _long_table(units, unit_type, features, level_names, full, without, se):
+    nr_units, nr_estimates = without.shape
+    change = without - full
+    return pd.DataFrame({
+        'unit_type': unit_type,
+        'unit': np.repeat(np.asarray(units), nr_estimates),
+        'feature': np.tile(features, nr_units),
+        'level': np.tile(level_names, nr_units),
+        'estimate': np.tile(full, nr_units),
+        'estimate_without': without.ravel(),
+        'change': change.ravel(),
+        'change_se': (change / se).ravel()
+    })
+
+
+def leave_out_amce(df, levels, outcome='Y', id_column='id', by=None):
+    '''
+    AMCE changes from leaving out each respondent, or each group of respondents, in turn.
+
+    The full-data cross-products are computed once and each left-out unit
+    is removed by subtracting its own cross-products, so all units cost
+    one batched solve instead of one refit each.
+
+    Parameters:
+    - df: long dataframe as returned by prep_conjoint
+    - levels: dictionary of attributes and their levels with the baseline first
+    - outcome: outcome column, e.g. 'Y' or 'rating'
+    - id_column: respondent id column, the unit left out by default
+    - by: optional respondent-level column to leave out groups instead,
+    e.g. 'canton' or 'region'
+
+    Returns a long dataframe with one row per left-out unit and AMCE, with
+    the full-sample estimate, the estimate without the unit, the change
+    and the change in full-sample standard errors
+    '''
+    X, _, valid = design_matrix(df, levels)
+    valid &= df[outcome].notna().to_numpy()
+    stats = cluster_crossproducts(X[valid], df[outcome].to_numpy()[valid], df[id_column].to_numpy()[valid])
+    beta, cov = fit_crossproducts(stats)
+
+    units, (xtx_units, xty_units) = _unit_sums(df, id_column, stats['clusters'], by, stats['xtx'], stats['xty'])
+    xtx_without = stats['xtx'].sum(axis=0) - xtx_units
+    xty_without = stats['xty'].sum(axis=0) - xty_units
+    beta_without = np.linalg.solve(xtx_without, xty_without[:, :, None])[:, :, 0]
+
+    features, level_names = _feature_labels(levels, include_baseline=False)
+    se = np.sqrt(np.diag(cov))
+    return _long_table(units, by or id_column, features, level_names, beta[1:], beta_without[:, 1:], se[1:])
+
+
+def leave_out_mm(df, levels, outcome='Y', id_column='id', by=None):
+    '''
+    Marginal mean changes from leaving out each respondent, or each group of respondents, in turn.
+
+    Parameters:
+    - df: long dataframe as returned by prep_conjoint
+    - levels: dictionary of attributes and their levels
+    - outcome: outcome column, e.g. 'Y' or 'rating'
+    - id_column: respondent id column, the unit left out by default
+    - by: optional respondent-level column to leave out groups instead
+
+    Returns a long dataframe in the layout of leave_out_amce
+    '''
+    codes, _ = encode_attributes(df, levels)
+    y = df[outcome].to_numpy(dtype=float)
+    cluster, clusters = pd.factorize(df[id_column], sort=True)
+    offsets = np.concatenate([[0], np.cumsum([len(level) for level in levels.values()])])
+    nr_levels, nr_clusters = offsets[-1], len(clusters)
+
+    # per-cluster counts and outcome sums of every level
+    valid = (codes >= 0) & ~np.isnan(y)[:, None]
+    keys = (np.broadcast_to(cluster[:, None], codes.shape) * nr_levels + codes + offsets[:-1])[valid]
+    y_keys = np.broadcast_to(y[:, None], codes.shape)[valid]
+    n = np.bincount(keys, minlength=nr_clusters * nr_levels).reshape(nr_clusters, nr_levels)
+    sums = np.bincount(keys, weights=y_keys, minlength=nr_clusters * nr_levels).reshape(nr_clusters, nr_levels)
+
+    units, (n_units, sums_units) = _unit_sums(df, id_column, clusters, by, n, sums)
+    full = sums.sum(axis=0) / n.sum(axis=0)
+    n_without = n.sum(axis=0) - n_units
+    without = (sums.sum(axis=0) - sums_units) / np.where(n_without > 0, n_without, np.nan)
+
+    # clustered standard errors of the full-sample MMs, as marginal_means
+    residual_sums = sums - n * full
+    se = np.sqrt((residual_sums ** 2).sum(axis=0) / n.sum(axis=0) ** 2 * nr_clusters / (nr_clusters - 1))
+
+    features, level_names = _feature_labels(levels, include_baseline=True)
+    return _long_table(units, by or id_column, features, level_names, full, without, se)
+
+
+def influence_summary(table, top=None):
+    '''
+    Rank left-out units by their largest standardized change.
+
+    Parameters:
+    - table: dataframe as returned by leave_out_amce or leave_out_mm
+    - top: optional number of most influential units to return
+
+    Returns one row per unit with the largest absolute change in standard
+    errors and the estimate it belongs to
+    '''
+    largest = table.loc[table['change_se'].abs().groupby(table['unit'], sort=False).idxmax()]
+    largest = largest.assign(max_abs_change_se=largest['change_se'].abs())
+    largest = largest.sort_values('max_abs_change_se', ascending=False, ignore_index=True)
+    columns = ['unit_type', 'unit', 'feature', 'level', 'change', 'max_abs_change_se']
+    return largest[columns] if top is None else largest[columns].head(top)
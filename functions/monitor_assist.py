@@ -0,0 +1,211 @@
+import pandas as pd
+import numpy as np
+from functions.data_assist import rename_columns
+from functions.prep_assist import conjoint_dict, simple_dict, experiment_attributes
+
+just_columns = ['justice_general_1', 'justice_tax_1', 'justice_subsidy_1',
+                'justice_general_2', 'justice_tax_2', 'justice_subsidy_2',
+                'justice_general_3', 'justice_tax_3', 'justice_subsidy_3',
+                'justice_general_4', 'justice_tax_4', 'justice_subsidy_4']
+
+
+def clean_batch(raw):
+    '''
+    Apply the cleaning steps of data_prep.py that the fieldwork monitor needs to a batch of raw responses.
+
+    Parameters:
+    - raw: pandas dataframe of raw Qualtrics responses, without the two
+    extra header rows of the export
+
+    Returns the finished, non-preview responses with duration in minutes
+    and the experiment column; conjoint levels are left untranslated, the
+    monitor translates its level counts instead
+    '''
+    df = raw.rename(columns={'languge': 'language'})
+    df = rename_columns(df, 'justice-', 'justice_')
+    df['Finished'] = df['Finished'].replace(
+        {'true': True, 'True': True, 'false': False, 'False': False}
+    ).astype(bool)
+    df['duration_min'] = (pd.to_numeric(df['Duration (in seconds)'], errors='coerce') / 60).round(3)
+
+    # filter out previews, recorded incompletes and quota fulls
+    df = df[(df['DistributionChannel'] != 'preview') & (df['Finished'] == True)]
+    df = df.dropna(subset=['canton'])
+
+    # rename columns for pv experiment, after filtering as this also renames DistributionChannel
+    for original_str, replacement_str in [('TargetMix', 'mix'),
+                                          ('Imports', 'imports'),
+                                          ('RooftopSolarPV', 'pv'),
+                                          ('Infrastructure', 'tradeoffs'),
+                                          ('Distribution', 'distribution')]:
+        df = rename_columns(df, original_str, replacement_str)
+
+    # add column for which experiment
+    df['experiment'] = pd.Series(np.nan, index=df.index, dtype=object)
+    df.loc[df['7_pv-choice'].notna(), 'experiment'] = 'pv'
+    df.loc[df['7_heat-choice'].notna(), 'experiment'] = 'heat'
+    return df
+
+
+class QuantileSketch:
+    '''
+    Mergeable quantile sketch with relative accuracy, for positive values such as durations.
+
+    Values are counted in logarithmic buckets (gamma^(i-1), gamma^i], so
+    adding a batch is one bincount, two sketches merge by adding their
+    counts, and every quantile is within the relative accuracy of a value
+    at that rank.
+
+    Parameters:
+    - relative_accuracy: relative error of the returned quantiles
+    '''
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = np.log(self.gamma)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.offset = 0
+        self.zero_count = 0
+        self.count = 0
+
+    def _add_counts(self, offset, counts):
+        if self.counts.size == 0:
+            self.counts, self.offset = counts.copy(), offset
+            return
+        low = min(self.offset, offset)
+        high = max(self.offset + len(self.counts), offset + len(counts))
+        merged = np.zeros(high - low, dtype=np.int64)
+        merged[self.offset - low:self.offset - low + len(self.counts)] += self.counts
+        merged[offset - low:offset - low + len(counts)] += counts
+        self.counts, self.offset = merged, low
+
+    def add(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        positive = values > 0
+        self.zero_count += int((~positive).sum())
+        self.count += len(values)
+        if positive.any():
+            keys = np.ceil(np.log(values[positive]) / self._log_gamma).astype(np.int64)
+            self._add_counts(keys.min(), np.bincount(keys - keys.min()))
+        return self
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("Only sketches with the same relative accuracy can be merged.")
+        self.zero_count += other.zero_count
+        self.count += other.count
+        if other.counts.size:
+            self._add_counts(other.offset, other.counts)
+        return self
+
+    def quantile(self, q):
+        if self.count == 0:
+            return np.nan
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0.0
+        index = np.searchsorted(np.cumsum(self.counts), rank - self.zero_count, side='right')
+        return 2 * self.gamma ** (self.offset + index) / (self.gamma + 1)
+
+    def count_below(self, value):
+        if value <= 0 or self.counts.size == 0:
+            return 0
+        key = int(np.ceil(np.log(value) / self._log_gamma))
+        return self.zero_count + int(self.counts[:max(key - self.offset, 0)].sum())
+
+    def count_above(self, value):
+        if self.counts.size == 0:
+            return 0
+        key = int(np.ceil(np.log(value) / self._log_gamma)) if value > 0 else self.offset - 1
+        return int(self.counts[max(key - self.offset + 1, 0):].sum())
+
+
+class FieldworkMonitor:
+    '''
+    Running quality flags and design counts during fieldwork.
+
+    Each batch of cleaned responses updates a duration sketch, the counts
+    of distinct answers on the justice items, the experiment split and
+    the attribute level counts per experiment, so a snapshot never needs
+    the earlier batches again.
+
+    Parameters:
+    - relative_accuracy: relative accuracy of the duration quantiles
+    - lower_quantile, upper_quantile: duration quantiles for speeders and
+    laggards, as in data_prep.py
+    '''
+
+    def __init__(self, relative_accuracy=0.01, lower_quantile=0.05, upper_quantile=0.95):
+        self.lower_quantile = lower_quantile
+        self.upper_quantile = upper_quantile
+        self.durations = QuantileSketch(relative_accuracy)
+        self.distinct_answers = np.zeros(len(just_columns) + 1, dtype=np.int64)
+        self.experiments = pd.Series(dtype='int64')
+        self.level_counts = {}
+
+    def update(self, batch):
+        '''
+        Add a batch of responses cleaned with clean_batch.
+        '''
+        self.durations.add(batch['duration_min'])
+
+        # straightlining: number of distinct answers across the justice items, ignoring missing ones as data_prep.py
+        distinct = batch[just_columns].nunique(axis=1).to_numpy().astype(np.int64)
+        self.distinct_answers += np.bincount(distinct, minlength=len(self.distinct_answers))
+
+        self.experiments = self.experiments.add(batch['experiment'].value_counts(), fill_value=0)
+
+        for experiment, attributes in experiment_attributes.items():
+            rows = batch[batch['experiment'] == experiment]
+            for attribute in attributes:
+                columns = rows.filter(regex=f'^choice\\d+_{attribute}_table').columns
+                counts = pd.Series(rows[columns].to_numpy().ravel()).value_counts()
+                key = (experiment, attribute)
+                self.level_counts[key] = self.level_counts.get(key, pd.Series(dtype='int64')).add(counts, fill_value=0)
+        return self
+
+    def merge(self, other):
+        '''
+        Combine with a monitor that saw other responses, e.g. another panel.
+        '''
+        self.durations.merge(other.durations)
+        self.distinct_answers += other.distinct_answers
+        self.experiments = self.experiments.add(other.experiments, fill_value=0)
+        for key, counts in other.level_counts.items():
+            self.level_counts[key] = self.level_counts.get(key, pd.Series(dtype='int64')).add(counts, fill_value=0)
+        return self
+
+    def snapshot(self):
+        '''
+        Current state of the fieldwork.
+
+        Returns a dictionary with the number of responses, the duration
+        thresholds and speeder/laggard counts under them, the number of
+        inattentive respondents, the experiment split, and a long dataframe
+        of attribute level counts per experiment
+        '''
+        lower = self.durations.quantile(self.lower_quantile)
+        upper = self.durations.quantile(self.upper_quantile)
+        nr_responses = self.distinct_answers.sum()
+
+        # translate the counted levels rather than every response
+        levels = []
+        for (experiment, attribute), counts in self.level_counts.items():
+            translated = counts.index.map(lambda level: simple_dict.get(conjoint_dict.get(level, level), conjoint_dict.get(level, level)))
+            counts = counts.groupby(translated.astype(str)).sum()
+            levels.append(pd.DataFrame({'experiment': experiment, 'attribute': attribute,
+                                        'level': counts.index, 'count': counts.to_numpy().astype(int)}))
+
+        return {
+            'responses': self.durations.count,
+            'lower_threshold': lower,
+            'upper_threshold': upper,
+            'speeders': self.durations.count_below(lower),
+            'laggards': self.durations.count_above(upper),
+            'inattentive': int(self.distinct_answers[1]),
+            'inattentive_rate': self.distinct_answers[1] / nr_responses if nr_responses else np.nan,
+            'experiments': self.experiments.astype(int).to_dict(),
+            'level_counts': pd.concat(levels, ignore_index=True) if levels else pd.DataFrame()
+        }
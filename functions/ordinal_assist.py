@@ -0,0 +1,176 @@
+import pandas as pd
+import numpy as np
+from scipy.optimize import minimize
+from scipy.special import expit
+from scipy.stats import norm
+from functions.estimation_assist import design_matrix, _estimate_table
+
+_links = {
+    'logit': (expit, lambda z: expit(z) * (1 - expit(z))),
+    'probit': (norm.cdf, norm.pdf)
+}
+
+
+def _to_cutpoints(alpha):
+    # first cutpoint free, the others as log increments so they stay ordered
+    return np.cumsum(np.concatenate([alpha[:, :1], np.exp(alpha[:, 1:])], axis=1), axis=1)
+
+
+def _to_alpha(cutpoints):
+    return np.concatenate([cutpoints[:, :1], np.log(np.diff(cutpoints, axis=1))], axis=1)
+
+
+def _observation_terms(X, y, group, beta, cutpoints, link):
+    # probability of the observed category and the derivatives of its log with respect to eta and both cutpoints
+    cdf, pdf = _links[link]
+    nr_groups, nr_cuts = cutpoints.shape
+    eta = np.einsum('ip,ip->i', X, beta[group])
+    padded = np.concatenate([np.full((nr_groups, 1), -np.inf), cutpoints, np.full((nr_groups, 1), np.inf)], axis=1)
+    upper = padded[group, y + 1] - eta
+    lower = padded[group, y] - eta
+    prob = np.maximum(cdf(upper) - cdf(lower), 1e-300)
+    f_upper = np.where(np.isfinite(upper), pdf(np.where(np.isfinite(upper), upper, 0)), 0)
+    f_lower = np.where(np.isfinite(lower), pdf(np.where(np.isfinite(lower), lower, 0)), 0)
+    return prob, -(f_upper - f_lower) / prob, f_upper / prob, -f_lower / prob
+
+
+def _cutpoint_gradient(y, group, d_upper, d_lower, nr_groups, nr_cuts):
+    # sum the cutpoint derivatives into (groups x cutpoints), cutpoint k is the upper bound of category k
+    size = nr_groups * (nr_cuts + 2)
+    grad = (np.bincount(group * (nr_cuts + 2) + y + 1, weights=d_upper, minlength=size)
+            + np.bincount(group * (nr_cuts + 2) + y, weights=d_lower, minlength=size))
+    return grad.reshape(nr_groups, nr_cuts + 2)[:, 1:-1]
+
+
+def _negative_loglik(theta, X, y, group, nr_groups, nr_cuts, link):
+    p = X.shape[1]
+    theta = theta.reshape(nr_groups, p + nr_cuts)
+    beta, alpha = theta[:, :p], theta[:, p:]
+    cutpoints = _to_cutpoints(alpha)
+    prob, d_eta, d_upper, d_lower = _observation_terms(X, y, group, beta, cutpoints, link)
+
+    keys = (group[:, None] * p + np.arange(p)).ravel()
+    grad_beta = np.bincount(keys, weights=(X * d_eta[:, None]).ravel(), minlength=nr_groups * p).reshape(nr_groups, p)
+    grad_cut = _cutpoint_gradient(y, group, d_upper, d_lower, nr_groups, nr_cuts)
+
+    # chain rule from cutpoints to the first cutpoint and log increments
+    grad_alpha = np.cumsum(grad_cut[:, ::-1], axis=1)[:, ::-1]
+    grad_alpha[:, 1:] *= np.exp(alpha[:, 1:])
+    grad = np.concatenate([grad_beta, grad_alpha], axis=1)
+    return -np.log(prob).sum(), -grad.ravel()
+
+
+def ordered_model(stacks,
+                  levels,
+                  outcome='rating',
+                  id_column='id',
+                  by='justice_class',
+                  link='logit',
+                  include_overall=True):
+    '''
+    Fit ordered logit or probit models of the rating outcome for every experiment and subgroup at once.
+
+    The subgroups of an experiment share its design matrix and their
+    log-likelihoods are summed into a single objective with analytic
+    gradients, so one optimisation per experiment fits every subgroup.
+    Standard errors are clustered by respondent.
+
+    Parameters:
+    - stacks: dictionary of experiments and their long dataframes as
+    returned by prep_conjoint, e.g. {'heat': df_heat, 'pv': df_pv}
+    - levels: dictionary of experiments and their attribute levels with
+    the baseline first, i.e. experiment_levels
+    - outcome: ordinal outcome column coded 0, 1, 2, ...
+    - id_column: respondent id column to cluster on
+    - by: optional subgroup column, e.g. 'justice_class'
+    - link: 'logit' or 'probit'
+    - include_overall: whether to also fit the whole sample of each experiment
+
+    Returns a dataframe in the layout of cregg with one row per
+    experiment, subgroup and coefficient, baseline levels at zero, and the
+    cutpoints as feature 'cutpoint'
+    '''
+    # stack the rows of every experiment subgroup, each subgroup with its own parameters
+    blocks = []
+    for experiment, df in stacks.items():
+        X, _, valid = design_matrix(df, levels[experiment])
+        valid &= df[outcome].notna().to_numpy()
+        subgroups = [('Overall sample', valid)] if include_overall else []
+        if by is not None:
+            subgroups += [(name, valid & (df[by] == name).to_numpy()) for name in sorted(df[by].dropna().unique())]
+        for name, mask in subgroups:
+            blocks.append((experiment, name, X[mask, 1:], df[outcome].to_numpy()[mask].astype(int),
+                           df[id_column].to_numpy()[mask]))
+
+    nr_cuts = max(block[3].max() for block in blocks)
+    tables = []
+    for experiment in stacks:
+        experiment_blocks = [block for block in blocks if block[0] == experiment]
+        X = np.concatenate([block[2] for block in experiment_blocks])
+        y = np.concatenate([block[3] for block in experiment_blocks])
+        clusters = np.concatenate([block[4] for block in experiment_blocks])
+        group = np.repeat(np.arange(len(experiment_blocks)), [len(block[3]) for block in experiment_blocks])
+        nr_groups, p = len(experiment_blocks), X.shape[1]
+
+        # start from zero effects and the observed cumulative shares of each subgroup
+        shares = np.array([np.cumsum(np.bincount(block[3], minlength=nr_cuts + 1))[:-1] / len(block[3])
+                           for block in experiment_blocks])
+        start_cuts = np.log(np.clip(shares, 1e-3, 1 - 1e-3) / (1 - np.clip(shares, 1e-3, 1 - 1e-3)))
+        start_cuts = np.maximum.accumulate(start_cuts + np.arange(nr_cuts) * 1e-3, axis=1)
+        theta = np.concatenate([np.zeros((nr_groups, p)), _to_alpha(start_cuts)], axis=1).ravel()
+
+        result = minimize(_negative_loglik, theta, jac=True, method='L-BFGS-B',
+                          args=(X, y, group, nr_groups, nr_cuts, link),
+                          options={'maxiter': 1000, 'ftol': 1e-12, 'gtol': 1e-8})
+        theta = result.x.reshape(nr_groups, p + nr_cuts)
+        beta, cutpoints = theta[:, :p], _to_cutpoints(theta[:, p:])
+
+        for g, (_, name, X_g, y_g, clusters_g) in enumerate(experiment_blocks):
+            cov = _clustered_covariance(X_g, y_g, clusters_g, beta[g], cutpoints[g], link)
+            se = np.sqrt(np.diag(cov))
+            estimate, std_error, features, level_names = [], [], [], []
+            column = 0
+            for attribute, attribute_levels in levels[experiment].items():
+                for k, level in enumerate(attribute_levels):
+                    features.append(attribute)
+                    level_names.append(level)
+                    estimate.append(0.0 if k == 0 else beta[g, column])
+                    std_error.append(np.nan if k == 0 else se[column])
+                    column += k > 0
+            features += ['cutpoint'] * nr_cuts
+            level_names += [f'{k}|{k + 1}' for k in range(nr_cuts)]
+            table = _estimate_table(np.concatenate([estimate, cutpoints[g]]),
+                                    np.concatenate([std_error, se[p:]]),
+                                    outcome, f'ordered {link}', features, level_names)
+            tables.append(table.assign(experiment=experiment, BY=name, converged=result.success))
+
+    return pd.concat(tables, ignore_index=True)
+
+
+def _clustered_covariance(X, y, clusters, beta, cutpoints, link, step=1e-5):
+    # sandwich with the numerical Hessian of the analytic gradient as bread and respondent-summed scores as meat
+    p, nr_cuts = X.shape[1], len(cutpoints)
+    group = np.zeros(len(y), dtype=np.int64)
+
+    def scores(theta):
+        prob, d_eta, d_upper, d_lower = _observation_terms(X, y, group, theta[None, :p], theta[None, p:], link)
+        score_cut = np.zeros((len(y), nr_cuts + 2))
+        score_cut[np.arange(len(y)), y + 1] = d_upper
+        score_cut[np.arange(len(y)), y] = d_lower
+        return np.concatenate([X * d_eta[:, None], score_cut[:, 1:-1]], axis=1)
+
+    theta = np.concatenate([beta, cutpoints])
+    hessian = np.empty((len(theta), len(theta)))
+    for j in range(len(theta)):
+        shift = np.zeros(len(theta))
+        shift[j] = step
+        hessian[:, j] = (scores(theta + shift).sum(axis=0) - scores(theta - shift).sum(axis=0)) / (2 * step)
+    hessian = (hessian + hessian.T) / 2
+
+    cluster_codes, labels = pd.factorize(clusters)
+    cluster_scores = np.zeros((len(labels), len(theta)))
+    np.add.at(cluster_scores, cluster_codes, scores(theta))
+    bread = np.linalg.inv(-hessian)
+    nr_clusters, nr_obs = len(labels), len(y)
+    correction = nr_clusters / (nr_clusters - 1) * (nr_obs - 1) / (nr_obs - len(theta))
+    return correction * bread @ cluster_scores.T @ cluster_scores @ bread
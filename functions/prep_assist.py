@@ -0,0 +1,387 @@
+import argparse
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from functions.conjoint_assist import prep_conjoint
+from functions.data_assist import apply_mapping
+
+# %% ################################## translation dictionaries #######################################
+
+translation_dict_heat = {
+    # ban
+    "Kein Verbot": "No ban",
+    "Pas d'interdiction": "No ban",
+    "Nessun divieto": "No ban",
+
+    "Verbot von Neuinstallationen": "Ban on new installations",
+    "Interdiction de nouvelles installations uniquement": "Ban on new installations",
+    "Divieto di installare nuovi boiler": "Ban on new installations",
+
+    "Verbot von Neuinstallationen und obligatorischer Austausch bestehender fossilen Heizungen": "Ban and fossil heating replacement",
+    "Interdiction de nouvelles installations et remplacement obligatoire des chauffages à combustibles fossiles existants": "Ban and fossil heating replacement",
+    "Divieto di installare nuovi boiler e sostituzione obbligatoria dei boiler esistenti": "Ban and fossil heating replacement",
+
+    # heat pump
+    "Wärmepumpe mit Subventionen kaufen": "Subsidy", 
+    "Achat d’une pompe à chaleur avec des subventions": "Subsidy",
+    "Acquisto di una pompa di calore con sovvenzioni": "Subsidy",
+
+    "Wärmepumpe von der Regierung leasen": "Governmental lease",
+    "Achat d’une pompe à chaleur en leasing auprès du gouvernement": "Governmental lease",
+    "Leasing di una pompa di calore di proprietà del governo": "Governmental lease",
+
+    "Wärmepumpen-Abo": "Subscription",
+    "Abonnement à une pompe à chaleur": "Subscription",
+    "Abbonamento ad una pompa di calore": "Subscription",
+
+    # building codes
+    "Neue Gebäude müssen energieeffizient sein": "New buildings must be energy efficient", 
+    "Les nouveaux bâtiments doivent être énergétiquement efficaces": "New buildings must be energy efficient",
+    "Nuovi edifici devono rispettare standard di alta efficienza energetica": "New buildings must be energy efficient",
+
+    "Neue Gebäude müssen energieeffizient sein und vor Ort erneuerbaren Strom erzeugen": "New buildings must be energy efficient and produce renewable electricity on-site",
+    "Les nouveaux bâtiments doivent être énergétiquement efficaces et produire de l'électricité renouvelable sur place": "New buildings must be energy efficient and produce renewable electricity on-site",
+    "Nuovi edifici devono rispettare standard di alta efficienza energetica e produrre elettricità rinnovabile in modo autonomo": "New buildings must be energy efficient and produce renewable electricity on-site",
+
+    "Alle Gebäude müssen energieeffizient sein": "All buildings need to be energy efficient",
+    "Tous les bâtiments doivent être énergétiquement efficaces": "All buildings need to be energy efficient",
+    "Tutti gli edifici devono rispettare standard di alta efficienza energetica": "All buildings need to be energy efficient",
+
+    "Alle Gebäude müssen energieeffizient sein und vor Ort erneuerbaren Strom erzeugen": "All buildings need to be energy efficient and produce renewable electricity on-site",
+    "Tous les bâtiments doivent être énergétiquement efficaces et produire de l'électricité renouvelable sur place": "All buildings need to be energy efficient and produce renewable electricity on-site",
+    "Tutti gli edifici devono rispettare standard di alta efficienza energetica e produrre elettricità rinnovabile in modo autonomo": "All buildings need to be energy efficient and produce renewable electricity on-site",
+    
+    # exemptions -- there's an error here somewhere
+    "Keine Ausnahmen": "No exemptions", 
+    "Pas d'exemption": "No exemptions",
+    "Nessuna eccezione": "No exemptions",
+
+    "Geringverdienende Haushalte sind ausgenommen": "Low-income households are exempted",
+    "Les ménages à revenus faibles sont exclus": "Low-income households are exempted",
+    "Sono esentate le famiglie e utenze a basso reddito": "Low-income households are exempted",
+
+    "Gering- und mittelverdienende Haushalte sind ausgenommen": "Low and middle-income households are exempted",
+    "Les ménages à revenus faibles et moyens sont exclus": "Low and middle-income households are exempted",
+    "Sono esentate le famiglie e utenze a basso e medio reddito": "Low and middle-income households are exempted"
+}
+
+translate_dict_pv = {
+    # target mix
+    'https://climatepolicy.qualtrics.com/ControlPanel/Graphic.php?IM=IM_Xuqo08nWGvzTaSr': 'More hydro',
+    'https://climatepolicy.qualtrics.com/ControlPanel/Graphic.php?IM=IM_lwjCDBh17ODzYQM': 'More hydro', 
+    'https://climatepolicy.qualtrics.com/ControlPanel/Graphic.php?IM=IM_FvSefnnxSgWbb8J': 'More hydro', 
+
+    'https://climatepolicy.qualtrics.com/ControlPanel/Graphic.php?IM=IM_PnFZWmknO1NZLvB': 'More solar', 
+    'https://climatepolicy.qualtrics.com/ControlPanel/Graphic.php?IM=IM_vCbbVKg7jmWJgva': 'More solar', 
+    'https://climatepolicy.qualtrics.com/ControlPanel/Graphic.php?IM=IM_WFCdHR97e3KUwQG': 'More solar', 
+
+    'https://climatepolicy.qualtrics.com/ControlPanel/Graphic.php?IM=IM_9LCSI0Qu1yQuHNY': 'More wind',
+    'https://climatepolicy.qualtrics.com/ControlPanel/Graphic.php?IM=IM_9dSwpo1C4dEgjHD': 'More wind', 
+    'https://climatepolicy.qualtrics.com/ControlPanel/Graphic.php?IM=IM_G9HNH3uNGMuVtEb': 'More wind', 
+
+    # rooftop pv requirements
+    'Keine Verpflichtungen': 'No obligation', 
+    'Nessun obbligo': 'No obligation', 
+    'Aucune obligation': 'No obligation', 
+
+    'Neuen öffentlichen und gewerblichen Gebäuden': 'New public and commercial buildings', 
+    'Les nouveaux bâtiments publics et commerciaux': 'New public and commercial buildings', 
+    'Nuovi edifici pubblici e commerciali': 'New public and commercial buildings',
+
+    'Neuen und existierenden öffentlichen und gewerblichen Gebäuden': 'New and existing public and commercial buildings', 
+    'Les bâtiments publics et commerciaux à la fois nouveaux et existants': 'New and existing public and commercial buildings', 
+    'Edifici pubblici e commerciali sia nuovi che esistenti': 'New and existing public and commercial buildings', 
+
+    'Allen neuen Gebäuden': 'All new buildings', 
+    'Tous les nouveaux bâtiments': 'All new buildings', 
+    'Tutti i nuovi edifici': 'All new buildings', 
+
+    'Allen neuen und existierenden Gebäuden': 'All new and existing buildings', 
+    'Tous les bâtiments neufs et existants': 'All new and existing buildings', 
+    'Tutti gli edifici nuovi ed esistenti': 'All new and existing buildings', 
+
+    # biodiversity tradeoffs
+    'Keine Ausnahmefälle': 'No trade-offs',
+    'Pas de cas exceptionnels': 'No trade-offs', 
+    'In nessun caso eccezionale': 'No trade-offs', 
+
+    'Alpenregionen': 'Alpine regions',
+    'Les régions alpines': 'Alpine regions', 
+    'Regioni alpine': 'Alpine regions', 
+
+    'Landwirtschaflichen Flächen': 'Agricultural areas',
+    'Les terres agricoles': 'Agricultural areas', 
+    'Superfici agricole': 'Agricultural areas',
+
+    'Wäldern': 'Forests',
+    'Les forêts': 'Forests', 
+    'Foreste': 'Forests', 
+
+    'Flüssen': 'Rivers',
+    'Les rivières': 'Rivers', 
+    'Fiumi': 'Rivers',
+
+    'Seen': 'Lakes', 
+    'Les lacs': 'Lakes', 
+    'Laghi': 'Lakes',
+
+    # cantonal distribution
+    'Keine Vorgabe': 'No agreed distribution', 
+    'Pas d\'objectif': 'No agreed distribution', 
+    'Nessun obiettivo': 'No agreed distribution', 
+
+    'Basierend auf dem Erzeugungspotenzial': 'Potential-based', 
+    'Basée sur la production maximale potentielle d’un canton': 'Potential-based', 
+    'In base al potenziale di un cantone': 'Potential-based', 
+
+    'Basierend auf der Bevölkerungszahl': 'Equal per person', 
+    'Basée sur le nombre de personnes vivant dans chaque canton': 'Equal per person',
+    'In base al numero di abitanti di ogni cantone': 'Equal per person', 
+
+    'Mindestensvorgabe pro Kanton': 'Minimum limit', 
+    'Un minimum de production par canton est établi': 'Minimum limit', 
+    'In base al livello di produzione minimo cantonale concordato': 'Minimum limit', 
+
+    'Deckelung pro Kanton': 'Maximum limit',
+    'Un maximum de production par canton est établi': 'Maximum limit',
+    'Nessun cantone produce più di un tetto massimo concordato': 'Maximum limit'
+}
+
+conjoint_dict = translation_dict_heat | translate_dict_pv
+
+# simplified attribute levels
+simple_dict_pv = {
+    # target mix
+    'More hydro': 'hydro',
+    'More solar': 'solar',
+    'More wind': 'wind',
+
+    # rooftop pv requirements
+    'No obligation': 'none',
+    'New public and commercial buildings': 'new-non-residential',
+    'New and existing public and commercial buildings': 'all-non-residential',
+    'All new buildings': 'all-new',
+    'All new and existing buildings': 'all',
+
+    # biodiversity tradeoffs
+    'No trade-offs': 'none',
+    'Alpine regions': 'alpine',
+    'Agricultural areas': 'agricultural',
+    'Forests': 'forests',
+    'Rivers': 'rivers',
+    'Lakes': 'lakes',
+
+    # cantonal distribution
+    'No agreed distribution': 'none',
+    'Potential-based': 'potential-based',
+    'Equal per person': 'equal-pp', 
+    'Minimum limit': 'min-limit',
+    'Maximum limit': 'max-limit',
+}
+
+simple_dict_heat = {
+    # ban
+    'No ban': 'none',
+    'Ban on new installations': 'new',
+    'Ban and fossil heating replacement': 'all',
+
+    # heatpump
+    'Subsidy': 'subsidy',
+    'Governmental lease': 'lease',
+    'Subscription': 'subscription',
+
+    # energyclass 
+    'New buildings must be energy efficient': 'new-only-efficient',
+    'New buildings must be energy efficient and produce renewable electricity on-site': 'new-efficient-renewable',
+    'All buildings need to be energy efficient': 'all-retrofit', 
+    'All buildings need to be energy efficient and produce renewable electricity on-site': 'all-retrofit-renewable',
+
+    # exemptions
+    'No exemptions': 'none',
+    'Low-income households are exempted': 'low',
+    'Low and middle-income households are exempted': 'low-mid'
+}
+
+simple_dict = simple_dict_heat | simple_dict_pv
+
+
+# %% ################################## stacking jobs #######################################
+
+# regex of the other experiment's attributes, dropped before stacking each experiment
+experiment_regex = {
+    'heat': 'pv|mix|imports|tradeoffs|distribution',
+    'pv': 'heat|year|tax|ban|energyclass|exemption'
+}
+
+# attribute levels of each experiment in the stacked conjoint files, baseline first as in factor_conjoint
+experiment_levels = {
+    'heat': {
+        'year': ['2050', '2045', '2040', '2035', '2030'],
+        'tax': ['0%', '25%', '50%', '75%', '100%'],
+        'ban': ['none', 'new', 'all'],
+        'heatpump': ['subsidy', 'lease', 'subscription'],
+        'energyclass': ['new-only-efficient', 'new-efficient-renewable', 'all-retrofit', 'all-retrofit-renewable'],
+        'exemption': ['none', 'low', 'low-mid']
+    },
+    'pv': {
+        'mix': ['hydro', 'solar', 'wind'],
+        'imports': ['0%', '10%', '20%', '30%'],
+        'pv': ['none', 'new-non-residential', 'all-non-residential', 'all-new', 'all'],
+        'tradeoffs': ['none', 'alpine', 'agricultural', 'forests', 'rivers', 'lakes'],
+        'distribution': ['none', 'potential-based', 'equal-pp', 'min-limit', 'max-limit']
+    }
+}
+
+experiment_attributes = {experiment: list(levels) for experiment, levels in experiment_levels.items()}
+
+# lpa output file and stack filemarker suffix for each class solution
+class_solutions = {
+    'g3': ('lpa_data.csv', ''),
+    'g4': ('lpa_data_g4.csv', '_g4')
+}
+
+respondent_columns = [
+    "id", "duration_min", "gender", "age", "region", "canton", "citizen", 
+    "education", "urbanness", "renting", "income", "household-size", "party", 
+    "satisfaction", "justice_class", "speeder", "laggard", "inattentive", 
+    "trust"
+]
+
+
+def translate_conjoints(df):
+    '''
+    Translate the conjoint attribute levels to English and simplify them. 
+
+    Parameters: 
+    - df: pandas dataframe of the cleaned survey data
+
+    Returns the dataframe with the simplified levels in all 'table' columns
+    '''
+    df = apply_mapping(df, conjoint_dict, column_pattern='table')
+    df = apply_mapping(df, simple_dict, column_pattern='table')
+    return df
+
+
+def add_justice_class(df, lpa_file):
+    '''
+    Build the respondent table for one class solution. 
+
+    Parameters: 
+    - df: pandas dataframe of the cleaned survey data
+    - lpa_file: path to the lpa output with 'id' and 'justice_class' columns, 
+    or the lpa output itself
+
+    Returns the respondent columns with the justice class of the solution
+    '''
+    lpa = pd.read_csv(lpa_file) if isinstance(lpa_file, str) else lpa_file
+    respondents = df[[col for col in respondent_columns if col != 'justice_class']]
+    respondents = respondents.merge(lpa[['id', 'justice_class']], on='id', how='left')
+    return respondents[respondent_columns]
+
+
+# wide frame and respondent tables read by the stacking workers
+_shared = {}
+
+
+def _init_worker(shared):
+    _shared.update(shared)
+
+
+def _stack_job(experiment, solution, output_dir):
+    filemarker = experiment + class_solutions[solution][1]
+    stack = prep_conjoint(_shared['df'], 
+                          respondent_columns=_shared['respondents'][solution], 
+                          regex_list=experiment_regex[experiment], 
+                          filemarker=filemarker, 
+                          output_dir=output_dir)
+    return filemarker, len(stack)
+
+
+def run_stacking(df, 
+                 respondents, 
+                 experiments=('heat', 'pv'), 
+                 solutions=('g3', 'g4'), 
+                 output_dir='data', 
+                 max_workers=None):
+    '''
+    Stack every experiment and class solution in parallel, one process per job. 
+
+    Parameters: 
+    - df: translated wide dataframe, shared read-only by all jobs
+    - respondents: dictionary of respondent tables per class solution, 
+    as returned by add_justice_class
+    - experiments, solutions: keys of experiment_regex and class_solutions 
+    to stack
+    - output_dir: folder the stacked csv files are written to
+    - max_workers: number of processes, by default one per job
+
+    Returns a dictionary with the number of stacked rows per filemarker
+    '''
+    jobs = [(experiment, solution) for solution in solutions for experiment in experiments]
+    shared = {'df': df, 'respondents': {solution: respondents[solution] for solution in solutions}}
+    max_workers = max_workers or min(len(jobs), os.cpu_count() or 1)
+
+    # forked workers inherit the wide frame copy-on-write, otherwise it is sent once per worker rather than once per job
+    if 'fork' in mp.get_all_start_methods():
+        _shared.update(shared)
+        context, initializer, initargs = mp.get_context('fork'), None, ()
+    else:
+        context, initializer, initargs = mp.get_context(), _init_worker, (shared,)
+
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers, 
+                                 mp_context=context, 
+                                 initializer=initializer, 
+                                 initargs=initargs) as pool:
+            futures = [pool.submit(_stack_job, experiment, solution, output_dir) for experiment, solution in jobs]
+            results = dict(future.result() for future in futures)
+    finally:
+        _shared.clear()
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Translate the cleaned survey data and stack the conjoint experiments to long format.'
+    )
+    parser.add_argument('--input', default='data/clean_data.csv', 
+                        help='cleaned survey data from data_prep.py')
+    parser.add_argument('--lpa-dir', default='data', 
+                        help='folder with the lpa class files')
+    parser.add_argument('--output-dir', default='data', 
+                        help='folder the stacked conjoint files are written to')
+    parser.add_argument('--experiments', nargs='+', choices=list(experiment_regex), 
+                        default=list(experiment_regex))
+    parser.add_argument('--solutions', nargs='+', choices=list(class_solutions), 
+                        default=list(class_solutions))
+    parser.add_argument('--weights', default=None, 
+                        help='optional csv with id and weight columns, e.g. from weights_prep.py')
+    parser.add_argument('--workers', type=int, default=None, 
+                        help='number of processes, by default one per job')
+    args = parser.parse_args(argv)
+
+    df = translate_conjoints(pd.read_csv(args.input))
+    respondents = {
+        solution: add_justice_class(df, os.path.join(args.lpa_dir, class_solutions[solution][0])) 
+        for solution in args.solutions
+    }
+    if args.weights is not None:
+        weights = pd.read_csv(args.weights)[['id', 'weight']]
+        respondents = {solution: table.merge(weights, on='id', how='left') for solution, table in respondents.items()}
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    results = run_stacking(df, 
+                           respondents, 
+                           experiments=args.experiments, 
+                           solutions=args.solutions, 
+                           output_dir=args.output_dir, 
+                           max_workers=args.workers)
+    for filemarker, nr_rows in results.items():
+        print(f'{filemarker}: {nr_rows} rows')
+
+
+if __name__ == '__main__':
+    main()
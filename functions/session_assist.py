@@ -0,0 +1,339 @@
+import argparse
+import copy
+import os
+import pickle
+import secrets
+import stat
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+import pandas as pd
+from functions.conjoint_assist import prep_conjoint, calculate_IRR
+from functions.data_assist import justice_reliability
+from functions.estimation_assist import amce, marginal_means
+from functions.prep_assist import experiment_regex, translate_conjoints, add_justice_class
+
+default_datasets = {
+    'clean': 'data/clean_data.csv',
+    'lpa': 'data/lpa_data.csv',
+    'lpa_g4': 'data/lpa_data_g4.csv',
+    'lpa_input': 'data/lpa_input.csv',
+    'heat': 'data/heat_conjoint.csv',
+    'pv': 'data/pv_conjoint.csv',
+    'heat_g4': 'data/heat_g4_conjoint.csv',
+    'pv_g4': 'data/pv_g4_conjoint.csv'
+}
+
+
+def stack_experiment(df, lpa, experiment='heat', filemarker=None, output_dir='data'):
+    '''
+    Translate the cleaned data and stack one experiment, as prep_assist.py does for each job.
+
+    Parameters:
+    - df: cleaned survey data
+    - lpa: lpa output with 'id' and 'justice_class' columns
+    - experiment: key of experiment_regex
+    - filemarker: name of the stacked file, the experiment by default
+    - output_dir: folder the stacked csv file is written to
+
+    Returns the long dataframe of prep_conjoint
+    '''
+    # translate on plain text columns, the session keeps them as categoricals
+    df = translate_conjoints(df.astype({column: object for column in df.filter(like='table').columns}))
+    return prep_conjoint(df,
+                         respondent_columns=add_justice_class(df, lpa),
+                         regex_list=experiment_regex[experiment],
+                         filemarker=filemarker or experiment,
+                         output_dir=output_dir)
+
+
+local_hosts = ('localhost', '127.0.0.1')
+
+
+def load_authkey(data_dir='data', create=False):
+    '''
+    Read the key clients need to connect to a session, created on the first start.
+
+    Parameters:
+    - data_dir: folder holding the key in '.session_key'
+    - create: whether to create a new random key if there is none yet
+
+    Returns the key as bytes
+    '''
+    path = os.path.join(data_dir, '.session_key')
+    if create and not os.path.exists(path):
+        # readable by the owner only, created atomically so no one else can race the write
+        with os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'wb') as file:
+            file.write(secrets.token_bytes(32))
+    if os.name == 'posix' and os.stat(path).st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+        raise PermissionError(f"{path} is accessible to other users, restrict it with chmod 600.")
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+session_calls = {
+    'prep_conjoint': stack_experiment,
+    'calculate_IRR': calculate_IRR,
+    'reliability': justice_reliability,
+    'marginal_means': marginal_means,
+    'amce': amce
+}
+
+# calls that write files, run every time rather than answered from the cache
+uncached_calls = {'prep_conjoint'}
+
+
+def compact_frame(df, max_categories=1000):
+    '''
+    Store the text columns of a dataframe as categoricals.
+
+    Parameters:
+    - df: pandas dataframe
+    - max_categories: text columns with more distinct values are left as they are
+
+    Returns the dataframe with the repeated text columns as categoricals,
+    which is most of the cleaned data and every attribute of the stacks
+    '''
+    for column in df.select_dtypes(include=['object', 'string']).columns:
+        if df[column].nunique() <= max_categories:
+            df[column] = df[column].astype('category')
+    return df
+
+
+class AnalysisSession:
+    '''
+    Cleaned data and conjoint stacks kept in memory with memoized analysis calls.
+
+    A dataset is read on its first use and only read again when its file
+    changes on disk. Results are cached by call, arguments and the
+    versions of the datasets they used, and the least recently used
+    results are dropped once the cache is full. Calls that write files
+    are never cached.
+
+    Parameters:
+    - datasets: dictionary of dataset names and csv paths, default_datasets by default
+    - max_results: number of results to keep
+    - preload: whether to read all datasets that exist right away
+    '''
+
+    def __init__(self, datasets=None, max_results=128, preload=True):
+        self.paths = dict(default_datasets if datasets is None else datasets)
+        self.max_results = max_results
+        self.frames = {}
+        self.versions = {}
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if preload:
+            for name, path in self.paths.items():
+                if os.path.exists(path):
+                    self.dataset(name)
+
+    def dataset(self, name):
+        '''
+        Dataset by name, read again if its file changed since the last read.
+        '''
+        if name not in self.paths:
+            raise KeyError(f"Unknown dataset '{name}', expected one of {sorted(self.paths)}.")
+        file_stat = os.stat(self.paths[name])
+        version = (file_stat.st_mtime_ns, file_stat.st_size)
+        if self.versions.get(name) != version:
+            self.frames[name] = compact_frame(pd.read_csv(self.paths[name], low_memory=False))
+            self.versions[name] = version
+        return self.frames[name]
+
+    def _resolve(self, value, used):
+        # '@name' arguments refer to datasets, also inside lists and dictionaries
+        if isinstance(value, str) and value.startswith('@'):
+            used[value[1:]] = None
+            return self.dataset(value[1:]).copy(deep=False)
+        if isinstance(value, dict):
+            return {key: self._resolve(item, used) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return type(value)(self._resolve(item, used) for item in value)
+        return value
+
+    def call(self, name, **kwargs):
+        '''
+        Run one of session_calls, or return its cached result.
+
+        Parameters:
+        - name: name of the call, e.g. 'marginal_means'
+        - kwargs: arguments of the call, with datasets given as '@name',
+        e.g. df='@heat'
+
+        Returns a copy of the result of the call and whether it came from the cache
+        '''
+        if name not in session_calls:
+            raise KeyError(f"Unknown call '{name}', expected one of {sorted(session_calls)}.")
+        used = {}
+        resolved = self._resolve(kwargs, used)
+        if name in uncached_calls:
+            return session_calls[name](**resolved), False
+        key = pickle.dumps((name, kwargs, [(dataset, self.versions[dataset]) for dataset in used]))
+
+        # callers get copies, so changing a result does not change the cache
+        if key in self.results:
+            self.results.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(self.results[key]), True
+
+        result = session_calls[name](**resolved)
+        self.misses += 1
+        self.results[key] = result
+        while len(self.results) > self.max_results:
+            self.results.popitem(last=False)
+        return copy.deepcopy(result), False
+
+    def status(self):
+        '''
+        Loaded datasets with their shape and memory use, and the cache counts.
+        '''
+        datasets = pd.DataFrame([
+            {'dataset': name,
+             'path': self.paths[name],
+             'rows': frame.shape[0],
+             'columns': frame.shape[1],
+             'memory_mb': frame.memory_usage(deep=True).sum() / 1e6}
+            for name, frame in self.frames.items()
+        ])
+        return {'datasets': datasets, 'results': len(self.results), 'hits': self.hits, 'misses': self.misses}
+
+    def clear(self):
+        self.results.clear()
+
+
+def _handle(session, lock, connection):
+    # one connection can send any number of requests until it closes
+    with connection:
+        while True:
+            try:
+                request = connection.recv()
+            except EOFError:
+                return
+            start = time.perf_counter()
+            try:
+                with lock:
+                    if request['call'] == 'status':
+                        result, cached = session.status(), False
+                    elif request['call'] == 'clear':
+                        result, cached = session.clear(), False
+                    else:
+                        result, cached = session.call(request['call'], **request.get('kwargs', {}))
+                reply = {'ok': True, 'result': result, 'cached': cached}
+            except Exception as error:
+                reply = {'ok': False, 'error': f'{type(error).__name__}: {error}'}
+            reply['seconds'] = time.perf_counter() - start
+            connection.send(reply)
+
+
+def serve(session, authkey, address=('localhost', 6010)):
+    '''
+    Answer analysis calls from other processes on this machine until interrupted.
+
+    Requests are pickled, so anyone who can connect can run code as the
+    user of the session; the session therefore only listens on localhost
+    or a unix socket, and clients have to prove they know the key.
+
+    Parameters:
+    - session: AnalysisSession holding the data
+    - authkey: key clients need to connect, see load_authkey; requests
+    are only unpickled after authentication
+    - address: (host, port) on localhost, or a path for a unix socket
+    '''
+    if isinstance(address, tuple) and address[0] not in local_hosts:
+        raise ValueError(f"The session only listens on {' or '.join(local_hosts)}, not on {address[0]}.")
+    lock = threading.Lock()
+    with Listener(address, authkey=authkey) as listener:
+        print(f'Serving {len(session.frames)} datasets on {listener.address}')
+        while True:
+            try:
+                connection = listener.accept()
+            except (AuthenticationError, OSError, EOFError) as error:
+                # failed authentication or a client that hung up straight away
+                print(f'Rejected connection: {error}')
+                continue
+            threading.Thread(target=_handle, args=(session, lock, connection), daemon=True).start()
+
+
+class AnalysisClient:
+    '''
+    Connection to a running analysis session.
+
+    Example:
+        client = AnalysisClient()
+        mms = client.call('marginal_means', df='@heat', levels=experiment_levels['heat'], by='justice_class')
+        client.call('prep_conjoint', df='@clean', lpa='@lpa_g4', experiment='pv', filemarker='pv_g4')
+
+    Parameters:
+    - address: as passed to serve
+    - authkey: as passed to serve, by default read from the key file in data_dir
+    - data_dir: data folder of the session
+    '''
+
+    def __init__(self, address=('localhost', 6010), authkey=None, data_dir='data'):
+        self.connection = Client(address, authkey=authkey or load_authkey(data_dir))
+        self.last_seconds = None
+        self.last_cached = None
+
+    def call(self, name, **kwargs):
+        self.connection.send({'call': name, 'kwargs': kwargs})
+        reply = self.connection.recv()
+        self.last_seconds = reply['seconds']
+        self.last_cached = reply.get('cached')
+        if not reply['ok']:
+            raise RuntimeError(reply['error'])
+        return reply['result']
+
+    def status(self):
+        return self.call('status')
+
+    def clear(self):
+        return self.call('clear')
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _address(value):
+    # 'host:port' for a local tcp socket, anything else is a unix socket path
+    host, _, port = value.rpartition(':')
+    if not port.isdigit():
+        return value
+    if host and host not in local_hosts:
+        raise argparse.ArgumentTypeError(f"The session only listens on {' or '.join(local_hosts)}, not on {host}.")
+    return (host or 'localhost', int(port))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Keep the cleaned data and conjoint stacks in memory and answer analysis calls.'
+    )
+    parser.add_argument('--address', type=_address, default='localhost:6010',
+                        help='localhost:port or a unix socket path')
+    parser.add_argument('--data-dir', default='data',
+                        help='folder with the cleaned data, lpa and conjoint files, and the session key')
+    parser.add_argument('--max-results', type=int, default=128,
+                        help='number of results kept in the cache')
+    args = parser.parse_args(argv)
+
+    datasets = {name: os.path.join(args.data_dir, os.path.basename(path)) for name, path in default_datasets.items()}
+    session = AnalysisSession(datasets, max_results=args.max_results)
+    authkey = load_authkey(args.data_dir, create=True)
+    try:
+        serve(session, authkey, args.address)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+import itertools
+import pandas as pd
+import numpy as np
+from scipy.special import expit
+from functions.estimation_assist import design_matrix
+
+
+def _loglik(beta, X, counts, successes):
+    eta = beta @ X.T
+    return (successes * eta - counts * np.logaddexp(0, eta)).sum(axis=1)
+
+
+def _fit_logit(X, counts, successes, batch_size=100, max_iter=50, tol=1e-8, ridge=1e-8):
+    '''
+    Fit many logit models on the same grouped design rows by batched Newton-Raphson.
+
+    Steps that lower the log-likelihood are halved, and a fit only counts
+    as converged once its full Newton step is below the tolerance. Fits
+    where a design column is never observed, or only ever with the same
+    outcome, have no finite estimate and are not run.
+
+    Parameters:
+    - X: (rows x p) distinct design rows
+    - counts, successes: (fits x rows) weighted number of observations and
+    of positive outcomes of every design row in each fit
+    - ridge: added to the diagonal of the Hessian so the steps can always be solved
+
+    Returns a (fits x p) array of coefficients, NaN for fits that did not
+    converge, and a boolean array of which fits converged
+    '''
+    nr_fits, p = counts.shape[0], X.shape[1]
+    beta = np.zeros((nr_fits, p))
+    converged = np.zeros(nr_fits, dtype=bool)
+
+    # separated or empty design columns
+    column_n, column_s = counts @ X, successes @ X
+    identified = ((column_n > 0) & (column_s > 0) & (column_s < column_n)).all(axis=1)
+
+    for start in range(0, nr_fits, batch_size):
+        active = np.flatnonzero(identified[start:start + batch_size]) + start
+        loglik = _loglik(beta[active], X, counts[active], successes[active])
+        for _ in range(max_iter):
+            if not len(active):
+                break
+            n, s, b = counts[active], successes[active], beta[active]
+            mu = expit(b @ X.T)
+            gradient = (s - n * mu) @ X
+            hessian = np.matmul(X.T[None, :, :] * (n * mu * (1 - mu))[:, None, :], X) + ridge * np.eye(p)
+            step = np.linalg.solve(hessian, gradient[:, :, None])[:, :, 0]
+
+            # halve the steps of the fits whose log-likelihood would drop
+            scale = np.ones(len(active))
+            for _ in range(30):
+                candidate = b + scale[:, None] * step
+                candidate_loglik = _loglik(candidate, X, n, s)
+                worse = candidate_loglik < loglik - 1e-12 * np.abs(loglik)
+                if not worse.any():
+                    break
+                scale[worse] /= 2
+            improved = ~worse
+            beta[active[improved]] = candidate[improved]
+            loglik[improved] = candidate_loglik[improved]
+
+            done = improved & (np.abs(step).max(axis=1) < tol)
+            converged[active[done]] = True
+            keep = improved & ~done
+            active, loglik = active[keep], loglik[keep]
+
+    beta[~converged] = np.nan
+    return beta, converged
+
+
+class PackageSimulator:
+    '''
+    Score every policy package of an experiment for the whole sample and each subgroup.
+
+    A logit model of the outcome on the attribute dummies is fitted once per
+    subgroup, together with respondent-clustered bootstrap draws of its
+    coefficients. Scoring the full grid of packages is then a batch of matrix
+    products, and rankings and head-to-head comparisons are cached per subgroup.
+
+    Scores are predicted probabilities and stay within [0, 1], but they
+    extrapolate a model that is additive on the logit scale to packages
+    that respondents may never have seen as a whole.
+
+    Parameters:
+    - df: long dataframe as returned by prep_conjoint, already filtered
+    - levels: dictionary of attributes and their levels with the baseline
+    first, e.g. experiment_levels['heat']
+    - outcome: outcome column, e.g. 'Y' for choices or a 0/1 support
+    column derived from the ratings
+    - by: optional subgroup column, e.g. 'justice_class'
+    - min_respondents: subgroups with fewer respondents are skipped
+    - threshold: predicted probability a package needs for majority support
+    - nr_draws: number of bootstrap draws for the uncertainty
+    - batch_size: number of packages scored per matrix product
+    - seed: seed of the bootstrap
+
+    Bootstrap draws whose logit fit does not converge, e.g. because a
+    level is never or always supported in the resample, are dropped; the
+    rankings and comparisons report how many.
+    '''
+
+    overall = 'Overall sample'
+
+    def __init__(self,
+                 df,
+                 levels,
+                 outcome='support',
+                 id_column='id',
+                 by='justice_class',
+                 min_respondents=30,
+                 threshold=0.5,
+                 nr_draws=500,
+                 batch_size=1024,
+                 seed=None):
+        self.levels = levels
+        self.outcome = outcome
+        self.threshold = threshold
+        self.batch_size = batch_size
+
+        X, self.names, valid = design_matrix(df, levels)
+        valid &= df[outcome].notna().to_numpy()
+        y = df[outcome].to_numpy(dtype=float)
+        ids = df[id_column].to_numpy()
+
+        groups = {self.overall: valid}
+        if by is not None:
+            for name in sorted(df[by].dropna().unique()):
+                groups[name] = valid & (df[by] == name).to_numpy()
+        for name, mask in list(groups.items()):
+            if len(np.unique(ids[mask])) < min_respondents:
+                print(f"Skipping subgroup {name}: fewer than {min_respondents} respondents")
+                del groups[name]
+
+        # point estimates and bootstrap draws per subgroup, on the distinct design rows of each respondent
+        rng = np.random.default_rng(seed)
+        self.coefficients, self.draws, self.converged, self.dropped_draws = {}, {}, {}, {}
+        for name, mask in groups.items():
+            rows, row = np.unique(X[mask], axis=0, return_inverse=True)
+            cluster, clusters = pd.factorize(ids[mask])
+            keys = cluster * len(rows) + row.ravel()
+            size = len(clusters) * len(rows)
+            counts = np.bincount(keys, minlength=size).reshape(len(clusters), len(rows))
+            successes = np.bincount(keys, weights=y[mask], minlength=size).reshape(len(clusters), len(rows))
+
+            resamples = rng.multinomial(len(clusters), np.full(len(clusters), 1 / len(clusters)), size=nr_draws)
+            beta, converged = _fit_logit(rows, counts.sum(axis=0)[None, :], successes.sum(axis=0)[None, :])
+            draws, draws_converged = _fit_logit(rows, resamples @ counts, resamples @ successes)
+            self.coefficients[name], self.converged[name] = beta[0], bool(converged[0])
+            self.draws[name] = draws[draws_converged]
+            self.dropped_draws[name] = int((~draws_converged).sum())
+
+        # full grid of attribute levels
+        self.packages = pd.DataFrame(list(itertools.product(*levels.values())), columns=list(levels))
+        self._grid, _, _ = design_matrix(self.packages, levels)
+        self._rankings = {}
+        self._comparisons = {}
+
+    @property
+    def subgroups(self):
+        return list(self.coefficients)
+
+    def rank(self, subgroup=overall, top=None):
+        '''
+        Rank all packages by their predicted outcome in a subgroup.
+
+        Parameters:
+        - subgroup: subgroup name, by default the overall sample
+        - top: optional number of best packages to return
+
+        Returns the packages with the predicted probability, its 95% bootstrap
+        interval, the share of draws above the majority threshold, whether
+        the point estimate converged and the number of dropped draws
+        '''
+        if subgroup not in self._rankings:
+            beta, draws = self.coefficients[subgroup], self.draws[subgroup]
+            lower, upper, p_majority = [], [], []
+            for start in range(0, len(self._grid) if len(draws) else 0, self.batch_size):
+                scores = expit(self._grid[start:start + self.batch_size] @ draws.T)
+                lower.append(np.quantile(scores, 0.025, axis=1))
+                upper.append(np.quantile(scores, 0.975, axis=1))
+                p_majority.append((scores > self.threshold).mean(axis=1))
+            if not len(draws):
+                # no converged draws, no uncertainty
+                lower = upper = p_majority = [np.full(len(self._grid), np.nan)]
+
+            ranking = self.packages.assign(
+                estimate=expit(self._grid @ beta),
+                lower=np.concatenate(lower),
+                upper=np.concatenate(upper),
+                p_majority=np.concatenate(p_majority),
+                converged=self.converged[subgroup],
+                dropped_draws=self.dropped_draws[subgroup]
+            )
+            ranking = ranking.sort_values('estimate', ascending=False, ignore_index=True)
+            ranking.insert(0, 'rank', np.arange(1, len(ranking) + 1))
+            self._rankings[subgroup] = ranking
+
+        ranking = self._rankings[subgroup]
+        return ranking if top is None else ranking.head(top)
+
+    def rank_all(self, top=10):
+        '''
+        Rank the packages in every subgroup.
+
+        Returns the best packages of each subgroup in one long dataframe
+        '''
+        return pd.concat([self.rank(subgroup, top).assign(subgroup=subgroup) for subgroup in self.subgroups],
+                         ignore_index=True)
+
+    def head_to_head(self, package_a, package_b, subgroup=overall):
+        '''
+        Compare two packages in a subgroup.
+
+        Parameters:
+        - package_a, package_b: dictionaries with one level per attribute
+        - subgroup: subgroup name, by default the overall sample
+
+        Returns a dictionary with the difference in predicted probability
+        (a - b), its 95% bootstrap interval and the share of draws where a
+        scores higher, whether the point estimate converged and the number of
+        dropped draws; for choices also the probability that a is chosen over b
+        '''
+        key = (tuple(package_a[attribute] for attribute in self.levels),
+               tuple(package_b[attribute] for attribute in self.levels),
+               subgroup)
+        if key not in self._comparisons:
+            pair = pd.DataFrame([package_a, package_b])[list(self.levels)]
+            X, _, valid = design_matrix(pair, self.levels)
+            if not valid.all():
+                raise ValueError("Both packages need a known level for every attribute.")
+            beta, draws = self.coefficients[subgroup], self.draws[subgroup]
+            difference = expit(X[0] @ beta) - expit(X[1] @ beta)
+            draws = expit(draws @ X[0]) - expit(draws @ X[1])
+            comparison = {
+                'difference': difference,
+                'lower': np.quantile(draws, 0.025) if len(draws) else np.nan,
+                'upper': np.quantile(draws, 0.975) if len(draws) else np.nan,
+                'p_a_better': (draws > 0).mean() if len(draws) else np.nan,
+                'converged': self.converged[subgroup],
+                'dropped_draws': self.dropped_draws[subgroup]
+            }
+            if self.outcome == 'Y':
+                # pairwise choice probability from the difference in utilities on the logit scale
+                comparison['p_a_chosen'] = float(expit((X[0] - X[1]) @ beta))
+            self._comparisons[key] = comparison
+        return self._comparisons[key]
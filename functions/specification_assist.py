@@ -0,0 +1,106 @@
+import itertools
+import pandas as pd
+import numpy as np
+from functions.estimation_assist import design_matrix, cluster_crossproducts, fit_crossproducts
+
+
+def _as_bool(values):
+    # flags are read from csv as booleans or as 'True'/'False' strings
+    return values.astype(str).str.lower().to_numpy() == 'true'
+
+
+def specification_curve(df,
+                        levels,
+                        outcome='Y',
+                        id_column='id',
+                        speed_cutoffs=(None, 0.01, 0.05, 0.10),
+                        laggard_filters=(True, False),
+                        inattentive_filters=(True, False),
+                        region_exclusions=((), ('italian',)),
+                        class_columns={'g3': 'justice_class'},
+                        durations=None,
+                        min_respondents=30):
+    '''
+    Estimate AMCEs under every combination of sample definitions.
+
+    The per-respondent cross-products are computed once; each
+    specification and subgroup is then a 0/1 weighting of the respondents,
+    and all of them are solved together from weighted sums of the
+    cross-products instead of one refit each.
+
+    Parameters:
+    - df: long dataframe as returned by prep_conjoint, unfiltered
+    - levels: dictionary of attributes and their levels with the baseline first
+    - outcome: outcome column, e.g. 'Y' or 'rating'
+    - id_column: respondent id column to cluster on
+    - speed_cutoffs: duration quantiles below which respondents count as
+    speeders and are dropped, None keeps all speeds
+    - laggard_filters, inattentive_filters: whether to drop respondents
+    flagged as laggards or inattentive
+    - region_exclusions: tuples of language regions to drop
+    - class_columns: dictionary of class solutions and the column holding
+    each, e.g. {'g3': 'justice_class', 'g4': 'justice_class_g4'}; every
+    specification is also estimated within each class
+    - durations: durations in minutes of the pooled sample the speed
+    quantiles are taken from, e.g. clean_data['duration_min'] as in
+    data_prep.py; by default the respondents of this stack, whose
+    quantiles differ from the pooled ones so that no cutoff reproduces the
+    speeder flag of the main analysis
+    - min_respondents: subgroups with fewer respondents are skipped
+
+    Returns a long dataframe with the specification, subgroup, number of
+    respondents and the AMCE of every non-baseline level
+    '''
+    X, _, valid = design_matrix(df, levels)
+    valid &= df[outcome].notna().to_numpy()
+    stats = cluster_crossproducts(X[valid], df[outcome].to_numpy()[valid], df[id_column].to_numpy()[valid])
+    respondents = df[valid].drop_duplicates(id_column).set_index(id_column).reindex(stats['clusters'])
+
+    duration = respondents['duration_min'].to_numpy(dtype=float)
+    pooled = duration if durations is None else np.asarray(durations, dtype=float)
+    speed_thresholds = {cutoff: np.nanquantile(pooled, cutoff) for cutoff in speed_cutoffs if cutoff is not None}
+    laggard = _as_bool(respondents['laggard'])
+    inattentive = _as_bool(respondents['inattentive'])
+    region = respondents['region'].to_numpy()
+    classes = {solution: respondents[column].to_numpy() for solution, column in class_columns.items()}
+
+    # one 0/1 weight row per specification and subgroup
+    spec_rows, weights = [], []
+    for cutoff, drop_laggards, drop_inattentives, excluded in itertools.product(
+            speed_cutoffs, laggard_filters, inattentive_filters, region_exclusions):
+        include = ~np.isin(region, list(excluded))
+        if cutoff is not None:
+            include &= duration >= speed_thresholds[cutoff]
+        if drop_laggards:
+            include &= ~laggard
+        if drop_inattentives:
+            include &= ~inattentive
+
+        spec = {'speed_cutoff': cutoff,
+                'filter_laggards': drop_laggards,
+                'filter_inattentives': drop_inattentives,
+                'excluded_regions': ', '.join(excluded) or 'none'}
+        subgroups = [(None, 'Overall sample', include)]
+        for solution, labels in classes.items():
+            subgroups += [(solution, label, include & (labels == label))
+                          for label in pd.unique(labels[~pd.isna(labels)])]
+        for solution, subgroup, mask in subgroups:
+            if mask.sum() >= min_respondents:
+                spec_rows.append({**spec, 'solution': solution, 'subgroup': subgroup, 'respondents': int(mask.sum())})
+                weights.append(mask)
+
+    beta, cov = fit_crossproducts(stats, np.array(weights, dtype=float))
+    se = np.sqrt(np.diagonal(cov, axis1=1, axis2=2))
+
+    features = [attribute for attribute, attribute_levels in levels.items() for _ in attribute_levels[1:]]
+    level_names = [level for attribute_levels in levels.values() for level in attribute_levels[1:]]
+    nr_specs, nr_estimates = len(spec_rows), len(features)
+    curve = pd.DataFrame(spec_rows).loc[np.repeat(np.arange(nr_specs), nr_estimates)].reset_index(drop=True)
+    return curve.assign(
+        feature=np.tile(features, nr_specs),
+        level=np.tile(level_names, nr_specs),
+        estimate=beta[:, 1:].ravel(),
+        **{'std.error': se[:, 1:].ravel()},
+        lower=(beta[:, 1:] - 1.96 * se[:, 1:]).ravel(),
+        upper=(beta[:, 1:] + 1.96 * se[:, 1:]).ravel()
+    )
@@ -0,0 +1,171 @@
+import pandas as pd
+import numpy as np
+
+
+def read_margins(path):
+    '''
+    Read population margins from a long csv file.
+
+    Parameters:
+    - path: csv file with columns 'variable', 'level' and 'share' (or
+    population counts), one row per level of each raking variable
+
+    Returns a dictionary mapping each variable to a dictionary of
+    level shares that sum to one
+    '''
+    margins_long = pd.read_csv(path, dtype={'variable': str, 'level': str})
+    margins = {}
+    for variable, group in margins_long.groupby('variable', sort=False):
+        shares = group.set_index('level')['share'].astype(float)
+        margins[variable] = (shares / shares.sum()).to_dict()
+    return margins
+
+
+def _encode_margins(df, margins):
+    # integer-code every raking variable against the levels of its margin
+    codes = np.empty((len(df), len(margins)), dtype=np.int64)
+    targets = []
+    for j, (variable, shares) in enumerate(margins.items()):
+        levels = list(shares.keys())
+        values, uniques = pd.factorize(df[variable])
+        if (values == -1).any():
+            raise ValueError(f"Column '{variable}' has missing values, drop or impute them before raking.")
+        # map the few observed values rather than every respondent to the margin levels
+        lookup = pd.Index(levels).get_indexer(uniques.astype(str))
+        if (lookup == -1).any():
+            raise ValueError(f"Levels {list(uniques[lookup == -1])} of '{variable}' have no population margin.")
+        codes[:, j] = lookup[values]
+        target = np.array([shares[level] for level in levels], dtype=float)
+        empty = (target > 0) & (np.bincount(codes[:, j], minlength=len(levels)) == 0)
+        if empty.any():
+            raise ValueError(f"Levels {[level for level, e in zip(levels, empty) if e]} of '{variable}' have no respondents.")
+        targets.append(target / target.sum())
+    return codes, targets
+
+
+def _trim(factor, cell_base, total, trim, max_iter=1000):
+    # clip the adjustment relative to its weighted mean until the clipped adjustment still lies within the bounds of its own mean
+    for _ in range(max_iter):
+        mean_factor = (cell_base * factor).sum() / total
+        low, high = trim[0] * mean_factor, trim[1] * mean_factor
+        if factor.min() >= low * (1 - 1e-12) and factor.max() <= high * (1 + 1e-12):
+            break
+        factor = np.clip(factor, low, high)
+    return factor
+
+
+def rake(df,
+         margins,
+         id_column='id',
+         base_weights=None,
+         trim=(0.2, 5),
+         max_iter=100,
+         tol=1e-6):
+    '''
+    Rake respondent weights to population margins with iterative proportional fitting.
+
+    Respondents are collapsed into the unique cells of the raking variables,
+    so each iteration costs one bincount per margin over the cells rather
+    than a groupby over the respondents.
+
+    Parameters:
+    - df: respondent dataframe, e.g. clean_data.csv, with one row per respondent
+    - margins: dictionary mapping column names to dictionaries of level
+    shares, e.g. {'region': {'german': 0.7, 'french': 0.25, ...}}, as
+    returned by read_margins
+    - id_column: respondent id column copied to the output
+    - base_weights: optional design weights, e.g. per wave, by default all 1
+    - trim: lower and upper bound of the raking adjustment, i.e. of the
+    final weight divided by the base weight scaled to mean one, or None
+    for no trimming; without base weights these are the bounds of the
+    final weights
+    - max_iter: maximum number of full sweeps over all margins
+    - tol: convergence tolerance on the largest absolute difference
+    between weighted and population shares
+
+    Returns a dataframe with the respondent ids and weights scaled to
+    mean one, and a dictionary of convergence diagnostics
+    '''
+    if trim is not None and not trim[0] <= 1 <= trim[1]:
+        raise ValueError("trim bounds must include 1, e.g. (0.2, 5).")
+    codes, targets = _encode_margins(df, margins)
+    base = np.ones(len(df)) if base_weights is None else np.asarray(base_weights, dtype=float)
+    base = base / base.mean()
+
+    # collapse respondents into cells of identical margin levels
+    nr_levels = np.array([len(target) for target in targets])
+    if np.prod(nr_levels.astype(float)) < 2 ** 62:
+        # mixed-radix key per respondent, so the cells come from a flat unique
+        radix = np.concatenate([np.cumprod(nr_levels[::-1])[::-1][1:], [1]])
+        keys, inverse = np.unique(codes @ radix, return_inverse=True)
+        cells = (keys[:, None] // radix) % nr_levels
+    else:
+        cells, inverse = np.unique(codes, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    cell_base = np.bincount(inverse, weights=base, minlength=len(cells))
+    total = cell_base.sum()
+
+    factor = np.ones(len(cells))
+    max_deviation = np.inf
+    for iteration in range(1, max_iter + 1):
+        for j, target in enumerate(targets):
+            weighted = np.bincount(cells[:, j], weights=cell_base * factor, minlength=len(target))
+            ratio = np.divide(target * weighted.sum(), weighted, out=np.ones_like(target), where=weighted > 0)
+            factor *= ratio[cells[:, j]]
+
+        if trim is not None:
+            factor = _trim(factor, cell_base, total, trim)
+
+        max_deviation = max(
+            np.abs(np.bincount(cells[:, j], weights=cell_base * factor, minlength=len(target)) / (cell_base * factor).sum() - target).max()
+            for j, target in enumerate(targets)
+        )
+        if max_deviation < tol:
+            break
+
+    # base has mean one, so dividing by the mean adjustment gives weights with mean one
+    adjustment = factor[inverse] / ((cell_base * factor).sum() / total)
+    weights = base * adjustment
+
+    diagnostics = {
+        'converged': bool(max_deviation < tol),
+        'iterations': iteration,
+        'max_deviation': float(max_deviation),
+        'nr_cells': len(cells),
+        'min_weight': float(weights.min()),
+        'max_weight': float(weights.max()),
+        'min_adjustment': float(adjustment.min()),
+        'max_adjustment': float(adjustment.max()),
+        'design_effect': float(len(weights) * (weights ** 2).sum() / weights.sum() ** 2),
+    }
+    diagnostics['effective_n'] = len(weights) / diagnostics['design_effect']
+
+    return pd.DataFrame({id_column: df[id_column].to_numpy(), 'weight': weights}), diagnostics
+
+
+def margin_table(df, weights, margins):
+    '''
+    Compare sample, weighted and population shares for each raking variable.
+
+    Parameters:
+    - df: respondent dataframe used for raking
+    - weights: weight column as returned by rake, aligned with df
+    - margins: dictionary of population shares used for raking
+
+    Returns a long dataframe with one row per variable and level
+    '''
+    codes, targets = _encode_margins(df, margins)
+    weights = np.asarray(weights, dtype=float)
+    tables = []
+    for j, (variable, shares) in enumerate(margins.items()):
+        counts = np.bincount(codes[:, j], minlength=len(shares))
+        weighted = np.bincount(codes[:, j], weights=weights, minlength=len(shares))
+        tables.append(pd.DataFrame({
+            'variable': variable,
+            'level': list(shares.keys()),
+            'count': counts,
+            'sample_share': counts / counts.sum(),
+            'weighted_share': weighted / weighted.sum(),
+            'population_share': targets[j]
+        }))
+    return pd.concat(tables, ignore_index=True)
@@ -0,0 +1,37 @@
+import pandas as pd
+from functions.estimation_assist import filter_respondents
+from functions.simulation_assist import PackageSimulator
+from functions.prep_assist import experiment_levels
+
+# %% read data
+
+df_heat = filter_respondents(pd.read_csv("data/heat_conjoint.csv"))
+df_pv = filter_respondents(pd.read_csv("data/pv_conjoint.csv"))
+
+# support when rated 'Eher dafür' or higher, as binary_values in data_prep.py
+for df in [df_heat, df_pv]:
+    df['support'] = (df['rating'] >= 3).astype(float).where(df['rating'].notna())
+
+# %% simulate support for every package, overall and per justice class
+
+sim_heat = PackageSimulator(df_heat, experiment_levels['heat'], outcome='support', by='justice_class', seed=42)
+sim_pv = PackageSimulator(df_pv, experiment_levels['pv'], outcome='support', by='justice_class', seed=42)
+
+top_heat = sim_heat.rank_all(top=10)
+top_pv = sim_pv.rank_all(top=10)
+print(top_heat)
+print(top_pv)
+
+# %% head-to-head: best package of each class against the best overall
+
+best_heat = sim_heat.rank().iloc[0][list(experiment_levels['heat'])].to_dict()
+for subgroup in sim_heat.subgroups[1:]:
+    best_class = sim_heat.rank(subgroup).iloc[0][list(experiment_levels['heat'])].to_dict()
+    print(subgroup, sim_heat.head_to_head(best_class, best_heat, subgroup))
+
+# %% save
+
+top_heat.to_csv("output/heat_package_ranking.csv", index=False)
+top_pv.to_csv("output/pv_package_ranking.csv", index=False)
+
+# %%
@@ -0,0 +1,30 @@
+import pandas as pd
+from functions.estimation_assist import filter_respondents, marginal_means
+from functions.ordinal_assist import ordered_model
+from functions.prep_assist import experiment_levels
+
+# %% read data
+
+stacks = {
+    'heat': filter_respondents(pd.read_csv("data/heat_conjoint.csv")),
+    'pv': filter_respondents(pd.read_csv("data/pv_conjoint.csv"))
+}
+
+# %% linear MMs of the 0-5 rating, as cj(..., rating ~ ...)
+
+mm_rating = pd.concat([
+    marginal_means(df, experiment_levels[experiment], outcome='rating', by='justice_class').assign(experiment=experiment)
+    for experiment, df in stacks.items()
+], ignore_index=True)
+
+# %% ordered logit of the rating for both experiments, overall and per justice class
+
+ologit_rating = ordered_model(stacks, experiment_levels, outcome='rating', by='justice_class', link='logit')
+print(ologit_rating[ologit_rating['feature'] != 'cutpoint'])
+
+# %% save
+
+mm_rating.to_csv("output/mm_rating.csv", index=False)
+ologit_rating.to_csv("output/ologit_rating.csv", index=False)
+
+# %%
@@ -0,0 +1,27 @@
+import pandas as pd
+from functions.monitor_assist import FieldworkMonitor, clean_batch
+
+# %% stream the raw export in batches
+
+monitor = FieldworkMonitor()
+
+# skip the two extra header rows of the Qualtrics export, as df.drop([0, 1]) in data_prep.py
+for batch in pd.read_csv('raw_data/raw_conjoint_120624.csv', skiprows=[1, 2], chunksize=500):
+    monitor.update(clean_batch(batch))
+
+# %% current state of the fieldwork
+
+snapshot = monitor.snapshot()
+print(f"Responses: {snapshot['responses']}")
+print(f"Lower threshold (lowest 5% quartile): {snapshot['lower_threshold']} minutes")
+print(f"Upper threshold (highest 5% quartile): {snapshot['upper_threshold']} minutes")
+print(f"Number of speeders (5% fastest): {snapshot['speeders']}")
+print(f"Number of laggards (5% slowest): {snapshot['laggards']}")
+print(f"Number of inattentive respondents: {snapshot['inattentive']}")
+print(f"Experiment split: {snapshot['experiments']}")
+print(snapshot['level_counts'])
+
+# %% new responses only need another update, e.g. for a later export
+# monitor.update(clean_batch(pd.read_csv('raw_data/new_responses.csv', skiprows=[1, 2])))
+
+# %%
@@ -0,0 +1,33 @@
+import pandas as pd
+from functions.weighting_assist import read_margins, rake, margin_table
+
+# %% read data
+
+df = pd.read_csv("data/clean_data.csv")
+
+# population margins in long format with columns variable, level, share
+# e.g. canton, age, gender, region and education shares from the federal statistical office
+margins = read_margins("data/census_margins.csv")
+
+# %% rake to population margins
+
+# collapse the oldest age groups as in factor_conjoint
+df['age'] = df['age'].replace({'80+': '65-79'})
+
+# respondents with missing raking variables keep no weight
+df_rake = df.dropna(subset=list(margins.keys()))
+print(f"Respondents dropped for missing raking variables: {len(df) - len(df_rake)}")
+
+weights, diagnostics = rake(df_rake, margins, trim=(0.2, 5))
+print(diagnostics)
+
+# %% check margins
+
+summary_table = margin_table(df_rake, weights['weight'], margins)
+print(summary_table)
+
+# %% save to file, merged into the stacks with --weights in functions.prep_assist
+
+weights.to_csv("data/weights.csv", index=False)
+
+# %%
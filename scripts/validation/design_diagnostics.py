@@ -0,0 +1,23 @@
+import pandas as pd
+from functions.design_assist import design_diagnostics
+from functions.prep_assist import experiment_levels
+
+# %% run design diagnostics per experiment
+
+level_tables, test_tables = [], []
+for experiment in ['heat', 'pv']:
+    df = pd.read_csv(f"data/{experiment}_conjoint.csv")
+    levels, tests, summary = design_diagnostics(df, experiment_levels[experiment])
+
+    print(f"Design diagnostics for {experiment}: {summary}")
+    print(tests[tests['p'] < 0.05], "\n")
+
+    level_tables.append(levels.assign(experiment=experiment))
+    test_tables.append(tests.assign(experiment=experiment))
+
+# %% save
+
+pd.concat(level_tables).to_csv("output/design_levels.csv", index=False)
+pd.concat(test_tables).to_csv("output/design_tests.csv", index=False)
+
+# %%
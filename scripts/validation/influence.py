@@ -0,0 +1,33 @@
+import pandas as pd
+from functions.estimation_assist import filter_respondents
+from functions.influence_assist import leave_out_amce, leave_out_mm, influence_summary
+from functions.prep_assist import experiment_levels
+
+# %% read data
+
+df_heat = filter_respondents(pd.read_csv("data/heat_conjoint.csv"))
+df_pv = filter_respondents(pd.read_csv("data/pv_conjoint.csv"))
+
+# %% leave out each respondent, canton and language region in turn
+
+influence_tables = []
+for experiment, df in [('heat', df_heat), ('pv', df_pv)]:
+    for by in [None, 'canton', 'region']:
+        amce_changes = leave_out_amce(df, experiment_levels[experiment], outcome='Y', by=by)
+        mm_changes = leave_out_mm(df, experiment_levels[experiment], outcome='Y', by=by)
+        influence_tables += [amce_changes.assign(experiment=experiment, statistic='amce'),
+                             mm_changes.assign(experiment=experiment, statistic='mm')]
+
+        print(f"Most influential units ({by or 'respondent'}) for {experiment}:")
+        print(influence_summary(amce_changes, top=5), "\n")
+
+# %% e.g. the effect of the Italian subsample, as in sample_effects.R
+
+influence = pd.concat(influence_tables, ignore_index=True)
+print(influence[(influence['unit'] == 'italian') & (influence['statistic'] == 'amce')])
+
+# %% save
+
+influence.to_csv("output/influence.csv", index=False)
+
+# %%
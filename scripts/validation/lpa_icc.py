@@ -1,6 +1,7 @@
 import pandas as pd
 import pingouin as pg
 import numpy as np
+from functions.data_assist import cronbach_alpha
 
 # %% import data
 
@@ -31,15 +32,6 @@ print(icc_results)
 
 # %% cronbach's alpha
 
-def cronbach_alpha(df):
-    # df should be a dataframe where each column is a measurement/item for a principle
-    item_scores = df.values
-    item_variances = item_scores.var(axis=0, ddof=1)
-    total_score_var = item_scores.sum(axis=1).var(ddof=1)
-    n_items = df.shape[1]
-    
-    return (n_items / (n_items - 1)) * (1 - item_variances.sum() / total_score_var)
-
 alpha_results = {}
 for principle in df_long['principle'].unique():
     # Pivot to create one column per variable (item) for each principle
@@ -0,0 +1,46 @@
+import pandas as pd
+from functions.specification_assist import specification_curve
+from functions.prep_assist import experiment_levels
+
+# %% read data, unfiltered, with both class solutions
+
+# speed quantiles over the pooled sample, as the speeder flag in data_prep.py
+durations = pd.read_csv("data/clean_data.csv", usecols=['duration_min'])['duration_min']
+
+curves = []
+for experiment in ['heat', 'pv']:
+    df = pd.read_csv(f"data/{experiment}_conjoint.csv")
+    classes_g4 = (
+        pd.read_csv(f"data/{experiment}_g4_conjoint.csv")[['id', 'justice_class']]
+        .drop_duplicates('id')
+        .rename(columns={'justice_class': 'justice_class_g4'})
+    )
+    df = df.merge(classes_g4, on='id', how='left')
+
+    # %% every combination of quality filters, speed cutoffs, region exclusions and class solutions
+
+    curve = specification_curve(
+        df,
+        experiment_levels[experiment],
+        outcome='Y',
+        speed_cutoffs=(None, 0.01, 0.05, 0.10),
+        laggard_filters=(True, False),
+        inattentive_filters=(True, False),
+        region_exclusions=((), ('italian',), ('romansh',), ('italian', 'romansh')),
+        class_columns={'g3': 'justice_class', 'g4': 'justice_class_g4'},
+        durations=durations
+    )
+    curves.append(curve.assign(experiment=experiment))
+
+curves = pd.concat(curves, ignore_index=True)
+
+# %% range of each overall AMCE across specifications
+
+overall = curves[curves['subgroup'] == 'Overall sample']
+print(overall.groupby(['experiment', 'feature', 'level'])['estimate'].agg(['min', 'median', 'max']))
+
+# %% save
+
+curves.to_csv("output/specification_curve.csv", index=False)
+
+# %%